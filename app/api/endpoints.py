@@ -34,31 +34,59 @@ async def get_recommendations(request: RecommendationRequest):
         engine_type = getattr(request, 'engine_type', 'hybrid')
         
         if engine_type == 'collaborative':
-            recommendations = engine.cf_engine.recommend_for_user(
+            movie_ids, scores = engine.cf_engine.recommend_for_user(
                 user_id=request.user_id,
-                n_recommendations=request.n_recommendations
+                n_recommendations=request.n_recommendations,
+                return_scores=True
             )
             engine_used = "collaborative"
+        elif engine_type == 'svd':
+            # Facteurs latents SVD : chemin rapide utilisable en cas de délestage
+            movie_ids, scores = engine.cf_engine.recommend_for_user(
+                user_id=request.user_id,
+                n_recommendations=request.n_recommendations,
+                return_scores=True,
+                mode='svd'
+            )
+            engine_used = "svd"
+        elif engine_type == 'staged':
+            # Candidats du filtrage collaboratif, re-classés par le modèle neuronal
+            movie_ids, scores = engine.staged_recommend(
+                user_id=request.user_id,
+                n_recommendations=request.n_recommendations,
+                return_scores=True,
+                genre=getattr(request, 'genre', None),
+                recent=getattr(request, 'recent', False)
+            )
+            engine_used = "staged"
         elif engine_type == 'neural':
-            recommendations = engine.neural_engine.recommend(
+            movie_ids, scores = engine.neural_engine.recommend(
                 user_id=request.user_id,
-                n_recommendations=request.n_recommendations
+                n_recommendations=request.n_recommendations,
+                exclude_rated=True,
+                return_scores=True
             )
             engine_used = "neural"
         else:  # hybrid par défaut
-            recommendations = engine.hybrid_recommend(
+            # genre / recent orientent le repli popularité des utilisateurs inconnus
+            movie_ids, scores = engine.hybrid_recommend(
                 user_id=request.user_id,
-                n_recommendations=request.n_recommendations
+                n_recommendations=request.n_recommendations,
+                return_scores=True,
+                genre=getattr(request, 'genre', None),
+                recent=getattr(request, 'recent', False)
             )
             engine_used = "hybrid"
         
+        recommendations = movie_ids.astype(int).tolist()
+        
         print(f" Envoi de {len(recommendations)} recommandations "
               f"(moteur: {engine_used})")
         
         return RecommendationResponse(
             user_id=request.user_id,
             recommendations=recommendations,
-            scores=[1.0] * len(recommendations),  # Scores simplifiés pour les tests
+            scores=scores.astype(float).tolist(),
             engine_type=engine_used
         )
     except Exception as e:
@@ -0,0 +1,92 @@
+import numpy as np
+from typing import Optional, Tuple
+
+from app.utils.ranking import top_k
+
+
+class IVFIndex:
+    """Index IVF (inverted file) pour la recherche approximative par produit scalaire.
+
+    Les vecteurs sont regroupés en `n_lists` clusters (k-means). Une requête ne
+    compare que les vecteurs des `n_probe` clusters les plus proches : augmenter
+    `n_probe` améliore le rappel, le diminuer accélère la recherche.
+    """
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 4,
+                 n_iter: int = 10, random_state: int = 42):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.vectors = None
+        self.centroids = None
+        self.list_offsets = None  # (n_lists + 1,) début de chaque liste dans list_items
+        self.list_items = None    # indices des vecteurs, groupés par cluster
+        self.assignments = None   # cluster de chaque vecteur
+
+    def fit(self, vectors: np.ndarray):
+        """Regroupe les vecteurs par k-means et construit les listes inversées"""
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_vectors = len(self.vectors)
+        n_lists = self.n_lists or int(np.sqrt(n_vectors))
+        n_lists = max(1, min(n_lists, n_vectors))
+
+        rng = np.random.default_rng(self.random_state)
+        self.centroids = self.vectors[rng.choice(n_vectors, n_lists, replace=False)].copy()
+
+        assignments = self._assign(self.vectors)
+        for _ in range(self.n_iter):
+            counts = np.bincount(assignments, minlength=n_lists)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, self.vectors)
+            non_empty = counts > 0  # un cluster vide garde son ancien centroïde
+            self.centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+            new_assignments = self._assign(self.vectors)
+            if np.array_equal(new_assignments, assignments):
+                break
+            assignments = new_assignments
+
+        self._build_lists(assignments)
+        return self
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Cluster le plus proche (distance euclidienne) de chaque vecteur"""
+        distances = (
+            -2 * vectors @ self.centroids.T
+            + np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+        )
+        return np.argmin(distances, axis=1)
+
+    def add(self, vectors: np.ndarray):
+        """Ajoute des vecteurs à l'index sans recalculer les centroïdes"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.vectors = np.vstack([self.vectors, vectors])
+        self._build_lists(np.concatenate([self.assignments, self._assign(vectors)]))
+        return self
+
+    def _build_lists(self, assignments: np.ndarray):
+        self.assignments = assignments
+        self.list_items = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def search(self, query: np.ndarray, k: int, n_probe: Optional[int] = None,
+               exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Retourne (indices, scores) des k vecteurs de plus grand produit scalaire avec `query`"""
+        query = np.asarray(query, dtype=np.float32)
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+
+        probed = top_k(self.centroids @ query, n_probe)
+        candidates = np.concatenate([
+            self.list_items[self.list_offsets[list_id]:self.list_offsets[list_id + 1]]
+            for list_id in probed
+        ])
+
+        scores = self.vectors[candidates] @ query
+        if exclude is not None and len(exclude):
+            scores[np.isin(candidates, exclude)] = -np.inf
+
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return candidates[best], scores[best]
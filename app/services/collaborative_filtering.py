@@ -1,79 +1,621 @@
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
 from sklearn.decomposition import TruncatedSVD
-import pickle
+from sklearn.preprocessing import normalize
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.ann_index import IVFIndex
+from app.utils.id_encoder import IdEncoder
+from app.utils.ranking import top_k, top_k_rows
+
+def top_k_neighbors(matrix: sp.csr_matrix, k: int, block_size: int = 1024,
+                    rows: np.ndarray = None):
+    """Top-k voisins cosinus de chaque ligne d'une matrice creuse.
+
+    Les similarités sont calculées par blocs de `block_size` lignes : la mémoire
+    crête reste bornée à block_size x n_lignes, jamais n_lignes².
+    Retourne (indices, poids) de forme (len(rows), k), triés par similarité décroissante.
+    """
+    n_rows = matrix.shape[0]
+    rows = np.arange(n_rows) if rows is None else np.asarray(rows)
+    k = max(0, min(k, n_rows - 1))
+
+    indices = np.empty((len(rows), k), dtype=np.int32)
+    weights = np.empty((len(rows), k), dtype=np.float32)
+    if k == 0:
+        return indices, weights
+
+    normed = normalize(matrix.astype(np.float32), norm='l2', axis=1).tocsr()
+    normed_t = normed.T.tocsc()
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        similarities = (normed[block_rows] @ normed_t).toarray()
+        similarities[np.arange(len(block_rows)), block_rows] = -np.inf  # pas soi-même
+
+        best = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        best_sims = np.take_along_axis(similarities, best, axis=1)
+        order = np.argsort(-best_sims, axis=1, kind='stable')
+
+        indices[start:start + len(block_rows)] = np.take_along_axis(best, order, axis=1)
+        weights[start:start + len(block_rows)] = np.take_along_axis(best_sims, order, axis=1)
+
+    return indices, weights
+
+
+# Version du format des artefacts sauvegardés par CollaborativeFiltering.save
+ARTIFACT_FORMAT_VERSION = 1
+# Fichier pointant vers la version courante d'un répertoire d'artefacts
+ARTIFACT_POINTER = 'CURRENT'
+
+_worker_model = None
+# Tenu pendant toute la vie d'un pool forké : deux appels concurrents ne partagent pas le global
+_worker_model_lock = threading.Lock()
+
+
+def _init_batch_worker(model):
+    """Initialise un processus de calcul par lots avec le modèle entraîné"""
+    global _worker_model
+    _worker_model = model
+
+
+def _score_chunk_in_worker(user_idx, n_recommendations, mode):
+    return _worker_model._recommend_chunk(user_idx, n_recommendations, mode)
+
+
+@contextmanager
+def _batch_executor(model, n_jobs: int):
+    """Pool de calcul par lots : avec fork, les processus héritent du modèle sans copie ni pickle"""
+    global _worker_model
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_batch_worker,
+                                 initargs=(model,)) as executor:
+            yield executor
+        return
+
+    with _worker_model_lock:
+        _worker_model = model
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                yield executor
+        finally:
+            _worker_model = None
+
 
 class CollaborativeFiltering:
-    def __init__(self):
-        self.user_similarity = None
-        self.item_similarity = None
+    def __init__(self, n_neighbors: int = 5, block_size: int = 1024, mode: str = 'user',
+                 ann_n_lists: int = None, ann_n_probe: int = 4, n_item_neighbors: int = 20,
+                 n_components: int = 20, svd_oversamples: int = 10, svd_power_iter: int = 5,
+                 svd_time_budget: float = None):
+        self.n_neighbors = n_neighbors
+        self.n_item_neighbors = n_item_neighbors
+        self.block_size = block_size
+        # 'user' (voisinage utilisateurs), 'item' (voisinage films),
+        # 'svd' (facteurs latents, calcul exhaustif) ou 'svd_ann' (facteurs latents, recherche approchée)
+        self.mode = mode
+        self.neighbor_indices = None  # (n_users, k) voisins les plus similaires
+        self.neighbor_weights = None  # (n_users, k) similarités associées
+        self.item_neighbor_indices = None  # (n_movies, k) films les plus similaires
+        self.item_neighbor_weights = None
+        self.item_similarity = None  # (n_movies, n_movies) CSR des listes de films similaires
         self.user_item_matrix = None
         self.svd_model = None
-        
+        self.n_components = n_components  # nombre maximal de composants SVD
+        self.svd_oversamples = svd_oversamples
+        self.svd_power_iter = svd_power_iter
+        self.svd_time_budget = svd_time_budget  # secondes, None = pas de limite
+        self.fit_times = {}
+        self.item_factors = None  # (n_movies, n_components) float32
+        self.ann_index = IVFIndex(n_lists=ann_n_lists, n_probe=ann_n_probe)
+        self.user_encoder = IdEncoder()
+        self.movie_encoder = IdEncoder()
+
+    def get_params(self) -> dict:
+        """Paramètres du constructeur, pour recréer un moteur configuré à l'identique"""
+        return {
+            'n_neighbors': self.n_neighbors,
+            'n_item_neighbors': self.n_item_neighbors,
+            'block_size': self.block_size,
+            'mode': self.mode,
+            'ann_n_lists': self.ann_index.n_lists,
+            'ann_n_probe': self.ann_index.n_probe,
+            'n_components': self.n_components,
+            'svd_oversamples': self.svd_oversamples,
+            'svd_power_iter': self.svd_power_iter,
+            'svd_time_budget': self.svd_time_budget,
+        }
+
+    def _build_matrix(self, ratings_df: pd.DataFrame, base: sp.csr_matrix = None) -> sp.csr_matrix:
+        """Construit la matrice utilisateur-item creuse (CSR, float32), à partir de `base` si fournie"""
+        user_idx = self.user_encoder.extend(ratings_df['user_id'].to_numpy())
+        movie_idx = self.movie_encoder.extend(ratings_df['movie_id'].to_numpy())
+        ratings = ratings_df['rating'].to_numpy(dtype=np.float32)
+        shape = (len(self.user_encoder), len(self.movie_encoder))
+
+        if base is not None:
+            base = base.tocoo()
+            user_idx = np.concatenate([base.row, user_idx])
+            movie_idx = np.concatenate([base.col, movie_idx])
+            ratings = np.concatenate([base.data, ratings])
+
+        # Une seule note par couple (user, movie) : la plus récente l'emporte
+        keys = user_idx.astype(np.int64) * shape[1] + movie_idx
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+
+        return sp.csr_matrix(
+            (ratings[keep], (user_idx[keep], movie_idx[keep])),
+            shape=shape,
+            dtype=np.float32
+        )
+
     def fit(self, ratings_df: pd.DataFrame):
         """Entraîne le modèle de filtrage collaboratif"""
-        # Création matrice utilisateur-item
-        self.user_item_matrix = ratings_df.pivot(
-            index='user_id', 
-            columns='movie_id', 
-            values='rating'
-        ).fillna(0)
-        
-        print(f" Matrice utilisateur-item: {self.user_item_matrix.shape}")
-        
-        # Similarité entre utilisateurs
-        self.user_similarity = cosine_similarity(self.user_item_matrix)
-        
+        fit_start = time.perf_counter()
+        self.fit_times = {}
+
+        # Création matrice utilisateur-item creuse : la mémoire dépend du nombre de notes
+        step_start = time.perf_counter()
+        self.user_encoder = IdEncoder()
+        self.movie_encoder = IdEncoder()
+        self.user_item_matrix = self._build_matrix(ratings_df)
+        self.fit_times['matrix'] = time.perf_counter() - step_start
+
+        print(f" Matrice utilisateur-item: {self.user_item_matrix.shape} "
+              f"({self.user_item_matrix.nnz} notes)")
+
+        # Graphe des k plus proches voisins, calculé par blocs
+        step_start = time.perf_counter()
+        self.neighbor_indices, self.neighbor_weights = top_k_neighbors(
+            self.user_item_matrix, self.n_neighbors, self.block_size
+        )
+
+        # Listes de films similaires, précalculées pour le mode item-item
+        if self.mode == 'item':
+            self.item_neighbor_indices, self.item_neighbor_weights = top_k_neighbors(
+                self.user_item_matrix.T.tocsr(), self.n_item_neighbors, self.block_size
+            )
+        self.item_similarity = self._build_item_similarity()
+        self.fit_times['neighbors'] = time.perf_counter() - step_start
+
         # SVD adaptatif - nombre de composants basé sur le nombre de films
+        step_start = time.perf_counter()
         n_movies = self.user_item_matrix.shape[1]
-        n_components = min(20, n_movies - 1)  # Maximum 20 composants ou n_movies-1
-        
+        n_components = min(self.n_components, n_movies - 1)  # Maximum n_components ou n_movies-1
+
         if n_components < 2:
             n_components = 2  # Minimum 2 composants
-            
-        print(f" SVD avec {n_components} composants sur {n_movies} films")
-        
-        self.svd_model = TruncatedSVD(n_components=n_components, random_state=42)
+
+        if self.svd_time_budget is not None:
+            n_components = self._components_for_budget(n_components)
+
+        # SVD randomisée en float32, directement sur la matrice creuse
+        self.svd_model = self._make_svd(n_components)
         self.svd_matrix = self.svd_model.fit_transform(self.user_item_matrix)
-        
+        self.fit_times['svd'] = time.perf_counter() - step_start
+
+        print(f" SVD avec {n_components} composants sur {n_movies} films "
+              f"({self.fit_times['svd']:.2f}s)")
+
+        # Index approximatif sur les facteurs films pour la recherche par produit scalaire
+        step_start = time.perf_counter()
+        self.item_factors = np.ascontiguousarray(self.svd_model.components_.T, dtype=np.float32)
+        self.ann_index.fit(self.item_factors)
+        self.fit_times['ann_index'] = time.perf_counter() - step_start
+
+        self.fit_times['total'] = time.perf_counter() - fit_start
+        print(f" Filtrage collaboratif entraîné en {self.fit_times['total']:.2f}s")
+        return self
+
+    def _make_svd(self, n_components: int) -> TruncatedSVD:
+        return TruncatedSVD(
+            n_components=n_components,
+            algorithm='randomized',
+            n_iter=self.svd_power_iter,
+            n_oversamples=self.svd_oversamples,
+            random_state=42
+        )
+
+    def _components_for_budget(self, max_components: int) -> int:
+        """Nombre de composants SVD qui tient dans le budget de temps.
+
+        Une SVD d'essai à 2 composants mesure le coût ; le temps de la SVD randomisée
+        croît à peu près linéairement avec n_components + n_oversamples.
+        """
+        probe_components = 2
+        probe_start = time.perf_counter()
+        self._make_svd(probe_components).fit(self.user_item_matrix)
+        probe_time = max(time.perf_counter() - probe_start, 1e-6)
+
+        remaining = self.svd_time_budget - probe_time
+        affordable = int(remaining / probe_time * (probe_components + self.svd_oversamples))
+        n_components = max(2, min(max_components, affordable - self.svd_oversamples))
+        print(f" Budget SVD {self.svd_time_budget:.2f}s: {n_components} composants "
+              f"(essai en {probe_time:.3f}s)")
+        return n_components
+
+    def partial_fit(self, new_ratings_df: pd.DataFrame):
+        """Intègre de nouvelles notes sans réentraînement complet.
+
+        Les nouveaux utilisateurs et films sont projetés dans la base SVD existante
+        (fold-in) et seules les listes de voisins concernées sont recalculées.
+        Un `fit` complet reste nécessaire périodiquement pour corriger la dérive.
+        """
+        if self.user_item_matrix is None:
+            return self.fit(new_ratings_df)
+
+        n_users_before, n_movies_before = self.user_item_matrix.shape
+        self.user_item_matrix = self._build_matrix(new_ratings_df, base=self.user_item_matrix)
+        n_users, n_movies = self.user_item_matrix.shape
+
+        affected_users = np.unique(self.user_encoder.encode(new_ratings_df['user_id'].to_numpy()))
+        affected_movies = np.unique(self.movie_encoder.encode(new_ratings_df['movie_id'].to_numpy()))
+
+        # Fold-in des utilisateurs modifiés ou nouveaux sur les films déjà connus :
+        # u = r_u Vᵀ (comme svd_model.transform)
+        svd_matrix = np.zeros((n_users, self.svd_matrix.shape[1]), dtype=self.svd_matrix.dtype)
+        svd_matrix[:n_users_before] = self.svd_matrix
+        svd_matrix[affected_users] = (
+            self.user_item_matrix[affected_users][:, :n_movies_before] @ self.svd_model.components_.T
+        )
+
+        # Fold-in des nouveaux films : V_i = Σ⁻² (UΣ)ᵀ r_i, avec les facteurs de tous les
+        # utilisateurs, y compris ceux qui viennent d'être projetés
+        if n_movies > n_movies_before:
+            new_columns = self.user_item_matrix[:, n_movies_before:]
+            projection = (new_columns.T @ svd_matrix).T
+            # Les composantes de valeur singulière nulle ne portent aucune information
+            squared = self.svd_model.singular_values_[:, None] ** 2
+            new_components = np.divide(projection, squared, out=np.zeros_like(projection),
+                                       where=squared > 1e-6 * squared.max())
+            # Un film noté uniquement par des utilisateurs sans historique n'a aucune projection :
+            # il reçoit le facteur du film moyen en attendant le prochain fit complet
+            isolated = ~np.any(new_components, axis=0)
+            new_components[:, isolated] = self.svd_model.components_.mean(axis=1, keepdims=True)
+            self.svd_model.components_ = np.hstack([self.svd_model.components_, new_components])
+
+            new_factors = np.ascontiguousarray(new_components.T, dtype=np.float32)
+            self.item_factors = np.vstack([self.item_factors, new_factors])
+            self.ann_index.add(new_factors)
+
+            # Seconde projection des utilisateurs : leurs notes sur les nouveaux films comptent aussi
+            svd_matrix[affected_users] = self.user_item_matrix[affected_users] @ self.svd_model.components_.T
+        self.svd_matrix = svd_matrix
+
+        # Rafraîchissement des seules listes de voisins concernées
+        self.neighbor_indices, self.neighbor_weights = self._refresh_neighbors(
+            self.user_item_matrix, self.neighbor_indices, self.neighbor_weights,
+            self.n_neighbors, affected_users
+        )
+        if self.item_neighbor_indices is not None:
+            self.item_neighbor_indices, self.item_neighbor_weights = self._refresh_neighbors(
+                self.user_item_matrix.T.tocsr(), self.item_neighbor_indices,
+                self.item_neighbor_weights, self.n_item_neighbors, affected_movies
+            )
+            self.item_similarity = self._build_item_similarity()
+
+        print(f" Mise à jour incrémentale: {len(new_ratings_df)} notes, "
+              f"{n_users - n_users_before} nouveaux utilisateurs, "
+              f"{n_movies - n_movies_before} nouveaux films")
         return self
-    
-    def recommend_for_user(self, user_id: int, n_recommendations: int = 10):
+
+    def _refresh_neighbors(self, matrix: sp.csr_matrix, indices: np.ndarray,
+                           weights: np.ndarray, k: int, rows: np.ndarray):
+        """Recalcule les voisins des lignes `rows` et ajoute celles des nouvelles lignes"""
+        n_rows = matrix.shape[0]
+        if min(k, n_rows - 1) != indices.shape[1]:
+            # Le nombre de voisins possibles a changé : graphe complet
+            return top_k_neighbors(matrix, k, self.block_size)
+
+        rows = np.union1d(rows, np.arange(len(indices), n_rows))
+        new_indices = np.empty((n_rows, indices.shape[1]), dtype=indices.dtype)
+        new_weights = np.empty((n_rows, weights.shape[1]), dtype=weights.dtype)
+        new_indices[:len(indices)] = indices
+        new_weights[:len(weights)] = weights
+        new_indices[rows], new_weights[rows] = top_k_neighbors(matrix, k, self.block_size, rows=rows)
+        return new_indices, new_weights
+
+    def _user_neighbors(self, user_idx: int):
+        """Voisins les plus similaires d'un utilisateur et leurs poids"""
+        return self.neighbor_indices[user_idx], self.neighbor_weights[user_idx]
+
+    def _score_user(self, user_idx: int) -> np.ndarray:
+        """Scores de tous les films pour un utilisateur (-inf pour les films déjà notés)"""
+        neighbors, weights = self._user_neighbors(user_idx)
+
+        # Agrégation pondérée des notes > 3 des voisins, en une seule opération creuse
+        neighbor_ratings = self.user_item_matrix[neighbors]
+        liked = neighbor_ratings.multiply(neighbor_ratings > 3)
+        scores = np.asarray(liked.T @ weights.astype(np.float32)).ravel()
+
+        # Films déjà notés par l'utilisateur
+        scores[self.user_item_matrix[user_idx].indices] = -np.inf
+        return scores
+
+    def _score_items_for_user(self, user_idx: int):
+        """Scores item-item : somme des voisins des films notés, pondérée par la note"""
+        if self.item_neighbor_indices is None:
+            raise ValueError("Le mode 'item' nécessite un entraînement avec mode='item'")
+
+        user_row = self.user_item_matrix[user_idx]
+        neighbors = self.item_neighbor_indices[user_row.indices]
+        contributions = self.item_neighbor_weights[user_row.indices] * user_row.data[:, None]
+
+        # Coût proportionnel à l'historique de l'utilisateur, pas à la taille du catalogue
+        candidates, inverse = np.unique(neighbors.ravel(), return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=contributions.ravel()).astype(np.float32)
+        scores[np.isin(candidates, user_row.indices)] = -np.inf
+        return candidates, scores
+
+    def recommend_for_user(self, user_id: int, n_recommendations: int = 10,
+                           return_scores: bool = False, mode: str = None):
         """Génère des recommandations pour un utilisateur"""
-        if user_id not in self.user_item_matrix.index:
+        mode = mode or self.mode
+        user_idx = self.user_encoder.get(user_id)
+        if user_idx is None:
             print(f"⚠️ Utilisateur {user_id} non trouvé")
-            return []
-            
-        user_idx = list(self.user_item_matrix.index).index(user_id)
-        user_ratings = self.user_item_matrix.iloc[user_idx]
-        
-        # Films déjà notés par l'utilisateur
-        rated_movies = user_ratings[user_ratings > 0].index.tolist()
-        
-        # Trouver les utilisateurs similaires (exclure l'utilisateur lui-même)
-        similar_users = np.argsort(self.user_similarity[user_idx])[::-1][1:6]  # Top 5
-        
-        # Calcul des scores de recommandation
-        recommendations = {}
-        for similar_user_idx in similar_users:
-            similarity_score = self.user_similarity[user_idx][similar_user_idx]
-            similar_user_id = self.user_item_matrix.index[similar_user_idx]
-            similar_user_ratings = self.user_item_matrix.iloc[similar_user_idx]
-            
-            for movie_id in similar_user_ratings.index:
-                # Ne recommander que les films non notés et avec rating > 3
-                if (movie_id not in rated_movies and 
-                    similar_user_ratings[movie_id] > 3 and 
-                    movie_id not in recommendations):
-                    
-                    recommendations[movie_id] = similar_user_ratings[movie_id] * similarity_score
-        
-        # Trier et retourner les meilleures recommandations
-        sorted_recs = sorted(recommendations.items(), 
-                           key=lambda x: x[1], reverse=True)[:n_recommendations]
-        
-        result = [movie_id for movie_id, score in sorted_recs]
-        print(f" Recommandations pour user {user_id}: {result}")
-        return result
\ No newline at end of file
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) if return_scores else []
+
+        if mode == 'user':
+            scores = self._score_user(user_idx)
+
+            # Sélection des meilleurs films sans tri complet
+            best = top_k(scores, n_recommendations)
+            best = best[scores[best] > 0]
+            best_scores = scores[best]
+        elif mode == 'item':
+            candidates, scores = self._score_items_for_user(user_idx)
+            best = top_k(scores, n_recommendations)
+            best = best[scores[best] > 0]
+            best, best_scores = candidates[best], scores[best]
+        elif mode == 'svd':
+            # Un seul produit matrice-vecteur sur les facteurs films précalculés
+            scores = self.item_factors @ self.svd_matrix[user_idx].astype(np.float32, copy=False)
+            scores[self.user_item_matrix[user_idx].indices] = -np.inf
+            best = top_k(scores, n_recommendations)
+            best = best[np.isfinite(scores[best])]
+            best_scores = scores[best]
+        elif mode == 'svd_ann':
+            # Recherche approchée : seuls les clusters sondés de l'index sont parcourus
+            best, best_scores = self.ann_index.search(
+                self.svd_matrix[user_idx], n_recommendations,
+                exclude=self.user_item_matrix[user_idx].indices
+            )
+        else:
+            raise ValueError(f"Mode de recommandation inconnu: {mode}")
+
+        movie_ids = self.movie_encoder.decode(best)
+
+        print(f" Recommandations pour user {user_id}: {movie_ids.tolist()}")
+        if return_scores:
+            return movie_ids, best_scores
+        return movie_ids.astype(int).tolist()
+
+    def recommend_for_users(self, user_ids, n_recommendations: int = 10, mode: str = None,
+                            chunk_size: int = 1024, n_jobs: int = 1):
+        """Recommandations par lots pour plusieurs utilisateurs.
+
+        Les utilisateurs sont traités par blocs de `chunk_size` (mémoire bornée à
+        chunk_size x n_movies) et, si `n_jobs` > 1, répartis sur un pool de processus.
+        Retourne (movie_ids, scores) de forme (len(user_ids), n_recommendations) ;
+        les cases vides valent -1 (ids) et NaN (scores), notamment pour les utilisateurs inconnus.
+        """
+        mode = mode or self.mode
+        user_idx = self.user_encoder.encode(np.asarray(user_ids))
+        if self.user_item_matrix is None:  # modèle non entraîné : rien à classer
+            return (np.full((len(user_idx), 0), -1, dtype=np.int64),
+                    np.full((len(user_idx), 0), np.nan, dtype=np.float32))
+        known = np.flatnonzero(user_idx >= 0)
+        n_recommendations = min(n_recommendations, self.user_item_matrix.shape[1])
+
+        movie_ids = np.full((len(user_idx), n_recommendations), -1, dtype=np.int64)
+        scores = np.full((len(user_idx), n_recommendations), np.nan, dtype=np.float32)
+
+        chunks = [known[start:start + chunk_size] for start in range(0, len(known), chunk_size)]
+        if n_jobs > 1 and len(chunks) > 1:
+            with _batch_executor(self, n_jobs) as executor:
+                results = executor.map(_score_chunk_in_worker, [user_idx[c] for c in chunks],
+                                       [n_recommendations] * len(chunks), [mode] * len(chunks))
+                results = list(results)
+        else:
+            results = [self._recommend_chunk(user_idx[c], n_recommendations, mode) for c in chunks]
+
+        for chunk, (best, best_scores) in zip(chunks, results):
+            valid = np.isfinite(best_scores)
+            movie_ids[chunk] = np.where(valid, self.movie_encoder.decode(best), -1)
+            scores[chunk] = np.where(valid, best_scores, np.nan)
+
+        print(f" Recommandations par lots: {len(known)}/{len(user_idx)} utilisateurs connus, "
+              f"{len(chunks)} blocs")
+        return movie_ids, scores
+
+    def _build_item_similarity(self):
+        """Matrice creuse des listes de films similaires, construite une fois par entraînement"""
+        if self.item_neighbor_indices is None:
+            return None
+        n_movies, k = self.item_neighbor_indices.shape
+        return sp.csr_matrix(
+            (np.asarray(self.item_neighbor_weights).ravel(),
+             (np.repeat(np.arange(n_movies), k), np.asarray(self.item_neighbor_indices).ravel())),
+            shape=(n_movies, n_movies)
+        )
+
+    def _recommend_chunk(self, user_idx: np.ndarray, n_recommendations: int, mode: str):
+        """Top-k d'un bloc d'utilisateurs : (indices films, scores), -inf si aucun candidat"""
+        n_movies = self.user_item_matrix.shape[1]
+        user_rows = self.user_item_matrix[user_idx]
+
+        if mode == 'user':
+            # Matrice creuse des poids voisins (bloc x voisins) puis un seul produit matriciel
+            neighbor_idx = self.neighbor_indices[user_idx]
+            neighbors = np.unique(neighbor_idx)
+            weights = sp.csr_matrix(
+                (self.neighbor_weights[user_idx].ravel(),
+                 (np.repeat(np.arange(len(user_idx)), neighbor_idx.shape[1]),
+                  np.searchsorted(neighbors, neighbor_idx.ravel()))),
+                shape=(len(user_idx), len(neighbors))
+            )
+            neighbor_ratings = self.user_item_matrix[neighbors]
+            liked = neighbor_ratings.multiply(neighbor_ratings > 3).tocsr()
+            scores = (weights @ liked).toarray()
+        elif mode == 'item':
+            if self.item_similarity is None:
+                raise ValueError("Le mode 'item' nécessite un entraînement avec mode='item'")
+            scores = (user_rows @ self.item_similarity).toarray()
+        elif mode == 'svd':
+            scores = self.svd_matrix[user_idx].astype(np.float32, copy=False) @ self.item_factors.T
+        elif mode == 'svd_ann':
+            # Pas de forme matricielle pour la recherche approchée : une requête par utilisateur
+            scores = np.full((len(user_idx), n_movies), -np.inf, dtype=np.float32)
+            for row, idx in enumerate(user_idx):
+                best, best_scores = self.ann_index.search(
+                    self.svd_matrix[idx], n_recommendations,
+                    exclude=self.user_item_matrix[idx].indices
+                )
+                scores[row, best] = best_scores
+        else:
+            raise ValueError(f"Mode de recommandation inconnu: {mode}")
+
+        scores = scores.astype(np.float32, copy=False)
+        if mode in ('user', 'item'):
+            scores[scores <= 0] = -np.inf
+        if mode != 'svd_ann':
+            rated = user_rows.tocoo()
+            scores[rated.row, rated.col] = -np.inf
+
+        return top_k_rows(scores, n_recommendations)
+
+    def save(self, path: str, keep_versions: int = 2):
+        """Sauvegarde le modèle entraîné dans un répertoire (tableaux .npy + manifest.json).
+
+        Chaque tableau est un fichier .npy séparé pour pouvoir être chargé en mmap.
+        Chaque sauvegarde crée une nouvelle version dans un sous-répertoire, puis le
+        fichier CURRENT est remplacé atomiquement : les fichiers déjà mappés par un
+        modèle chargé ne sont jamais réécrits. Seules les keep_versions dernières
+        versions sont conservées.
+        """
+        if self.user_item_matrix is None:
+            raise ValueError("Le modèle doit être entraîné avant d'être sauvegardé")
+
+        os.makedirs(path, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=path)
+        matrix = self.user_item_matrix
+        arrays = {
+            'user_ids': self.user_encoder.ids,
+            'movie_ids': self.movie_encoder.ids,
+            'matrix_data': matrix.data,
+            'matrix_indices': matrix.indices,
+            'matrix_indptr': matrix.indptr,
+            'neighbor_indices': self.neighbor_indices,
+            'neighbor_weights': self.neighbor_weights,
+            'svd_components': self.svd_model.components_,
+            'svd_singular_values': self.svd_model.singular_values_,
+            'svd_matrix': self.svd_matrix,
+            'item_factors': self.item_factors,
+            'ann_centroids': self.ann_index.centroids,
+            'ann_list_offsets': self.ann_index.list_offsets,
+            'ann_list_items': self.ann_index.list_items,
+            'ann_assignments': self.ann_index.assignments,
+        }
+        if self.item_neighbor_indices is not None:
+            arrays['item_neighbor_indices'] = self.item_neighbor_indices
+            arrays['item_neighbor_weights'] = self.item_neighbor_weights
+
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging_dir, f'{name}.npy'), np.ascontiguousarray(array))
+
+            manifest = {
+                'format_version': ARTIFACT_FORMAT_VERSION,
+                'shape': list(matrix.shape),
+                'params': self.get_params(),
+                'arrays': {
+                    name: {'shape': list(array.shape), 'dtype': str(array.dtype)}
+                    for name, array in arrays.items()
+                },
+            }
+            with open(os.path.join(staging_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        # Publication : renommage du répertoire complet puis bascule atomique du pointeur
+        version = f'v{time.time_ns()}'
+        os.replace(staging_dir, os.path.join(path, version))
+        pointer_tmp = os.path.join(path, f'.{ARTIFACT_POINTER}.tmp')
+        with open(pointer_tmp, 'w') as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(path, ARTIFACT_POINTER))
+
+        # Les anciennes versions sont supprimées, jamais tronquées : un modèle qui les
+        # mappe encore garde ses données jusqu'à la fermeture des fichiers
+        versions = sorted(name for name in os.listdir(path) if name.startswith('v'))
+        for old_version in versions[:-keep_versions] if keep_versions > 0 else []:
+            if old_version != version:
+                shutil.rmtree(os.path.join(path, old_version), ignore_errors=True)
+
+        print(f" Modèle collaboratif sauvegardé dans {path} (version {version})")
+        return path
+
+    @staticmethod
+    def _artifact_dir(path: str) -> str:
+        """Répertoire de la version courante (ou `path` lui-même s'il contient un manifest)"""
+        pointer = os.path.join(path, ARTIFACT_POINTER)
+        if os.path.exists(pointer):
+            with open(pointer) as f:
+                return os.path.join(path, f.read().strip())
+        return path
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r') -> "CollaborativeFiltering":
+        """Charge un modèle sauvegardé ; avec mmap_mode='r' les tableaux restent sur disque
+        et sont partagés entre processus via le cache de pages du système"""
+        path = cls._artifact_dir(path)
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest['format_version'] != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Version d'artefact non supportée: {manifest['format_version']}")
+
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in manifest['arrays']
+        }
+
+        model = cls(**manifest['params'])
+        model.user_encoder = IdEncoder.from_arrays(arrays['user_ids'])
+        model.movie_encoder = IdEncoder.from_arrays(arrays['movie_ids'])
+        model.user_item_matrix = sp.csr_matrix(
+            (arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+            shape=tuple(manifest['shape']), copy=False
+        )
+        model.neighbor_indices = arrays['neighbor_indices']
+        model.neighbor_weights = arrays['neighbor_weights']
+        model.item_neighbor_indices = arrays.get('item_neighbor_indices')
+        model.item_neighbor_weights = arrays.get('item_neighbor_weights')
+        model.item_similarity = model._build_item_similarity()
+
+        model.svd_model = TruncatedSVD(n_components=len(arrays['svd_singular_values']))
+        model.svd_model.components_ = arrays['svd_components']
+        model.svd_model.singular_values_ = arrays['svd_singular_values']
+        model.svd_model.n_features_in_ = arrays['svd_components'].shape[1]
+        model.svd_matrix = arrays['svd_matrix']
+        model.item_factors = arrays['item_factors']
+
+        model.ann_index.vectors = model.item_factors
+        model.ann_index.centroids = arrays['ann_centroids']
+        model.ann_index.list_offsets = arrays['ann_list_offsets']
+        model.ann_index.list_items = arrays['ann_list_items']
+        model.ann_index.assignments = arrays['ann_assignments']
+
+        print(f" Modèle collaboratif chargé depuis {path} (format v{manifest['format_version']})")
+        return model
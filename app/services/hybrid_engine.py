@@ -1,57 +1,393 @@
+import numpy as np
+import os
 import pandas as pd
-from typing import List
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threadpoolctl import threadpool_limits
+from typing import Dict, Optional, Tuple
 from .collaborative_filtering import CollaborativeFiltering
 from .neural_embeddings import NeuralRecommendation
+from .popularity import PopularityIndex
+from app.utils.ranking import top_k
+
+
+def _fit_cf_in_worker(ratings_df: pd.DataFrame, params: dict, path: str, n_threads: int) -> dict:
+    """Entraîne le filtrage collaboratif dans un processus dédié et l'écrit sur disque"""
+    start = time.perf_counter()
+    with threadpool_limits(limits=n_threads):
+        cf_engine = CollaborativeFiltering(**params)
+        cf_engine.fit(ratings_df)
+    cf_engine.save(path)
+    return {'wall_time': time.perf_counter() - start, 'fit_times': cf_engine.fit_times}
+
+
+def _train_neural_in_worker(ratings_df: pd.DataFrame, params: dict, train_kwargs: dict,
+                            path: str, n_threads: int) -> dict:
+    """Entraîne le modèle neuronal dans un processus dédié et écrit son checkpoint"""
+    import torch  # seul ce processus a besoin de régler les threads torch
+    
+    start = time.perf_counter()
+    torch.set_num_threads(n_threads)
+    with threadpool_limits(limits=n_threads):
+        neural_engine = NeuralRecommendation(**params)
+        history = neural_engine.train(ratings_df, **train_kwargs)
+    neural_engine.save_checkpoint(path)
+    return {'wall_time': time.perf_counter() - start, 'history': history,
+            'training_stats': neural_engine.training_stats}
+
 
 class HybridEngine:
-    def __init__(self):
+    def __init__(self, cf_timeout: Optional[float] = None, neural_timeout: Optional[float] = None,
+                 max_workers: Optional[int] = None, fusion: str = 'weighted',
+                 fusion_weights: Optional[Dict[str, float]] = None, rrf_k: int = 60):
         self.cf_engine = CollaborativeFiltering()
         self.neural_engine = NeuralRecommendation()
         self.is_fitted = False
+        self.training_history = {}
+        self.fit_times = {}  # durée d'entraînement par moteur (secondes)
+        self.artifacts_dir = None  # artefacts servis du dernier entraînement parallèle
+        self._artifacts_root = None  # répertoire temporaire réutilisé sans artifacts_dir
+        # Classements précalculés : repli des utilisateurs inconnus et récupérateur 'popularity'
+        self.popularity = PopularityIndex()
+        # Délais maximum par moteur (secondes, None = pas de limite), comptés depuis le début
+        # de la requête : les deux moteurs tournent en parallèle sur le pool de threads
+        self.engine_timeouts = {'collaborative': cf_timeout, 'neural': neural_timeout}
+        # Deux tâches par requête, plus de la marge pour les calculs hors délai encore en cours
+        # (une tâche hors délai non démarrée est annulée et ne bloque pas le pool)
+        max_workers = max_workers or 2 * (os.cpu_count() or 1) + 2
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid')
+        self.timeout_counts = {'collaborative': 0, 'neural': 0}
+        self._timeout_lock = threading.Lock()
+        # Statistiques de la dernière requête, propres à chaque thread appelant
+        self._request_local = threading.local()
+        # Fusion des scores : 'weighted' (scores normalisés min-max pondérés)
+        # ou 'rrf' (reciprocal rank fusion, poids / (rrf_k + rang))
+        if fusion not in ('weighted', 'rrf'):
+            raise ValueError(f"Fusion inconnue: {fusion}")
+        self.fusion = fusion
+        self.fusion_weights = fusion_weights or {'collaborative': 0.5, 'neural': 0.5}
+        self.rrf_k = rrf_k
         
-    def fit(self, ratings_df: pd.DataFrame):
-        """Entraîne les deux moteurs"""
+    @property
+    def last_request_stats(self) -> dict:
+        """Statistiques de la dernière requête traitée par le thread courant"""
+        return getattr(self._request_local, 'stats', {})
+    
+    @last_request_stats.setter
+    def last_request_stats(self, stats: dict):
+        self._request_local.stats = stats
+    
+    def fit(self, ratings_df: pd.DataFrame, movies_df: Optional[pd.DataFrame] = None,
+            epochs: int = 5, validation_split: float = 0.0,
+            patience: Optional[int] = None, max_train_time: Optional[float] = None,
+            parallel: bool = False, cf_threads: Optional[int] = None,
+            neural_threads: Optional[int] = None, artifacts_dir: Optional[str] = None):
+        """Entraîne les deux moteurs.
+
+        movies_df (colonnes movie_id, genres) alimente le classement par genre de l'index
+        de popularité utilisé pour les utilisateurs inconnus.
+
+        epochs est un maximum : le modèle neuronal s'arrête plus tôt quand max_train_time
+        secondes sont écoulées ou, si validation_split > 0, quand le RMSE de validation
+        stagne (patience). La validation retire ces notes de l'entraînement : à réserver
+        au réglage du nombre d'epochs, le modèle servi étant entraîné sans split.
+
+        Avec parallel=True, chaque moteur est entraîné dans son propre processus avec son
+        budget de threads (par défaut la moitié des CPU chacun). Les modèles reviennent par
+        disque, dans un sous-répertoire propre à chaque entraînement de artifacts_dir
+        (répertoire temporaire par défaut) : artefact .npy chargé en mmap pour le
+        collaboratif, checkpoint pour le neuronal. Les fichiers mappés par le moteur servi
+        ne sont jamais réécrits ; l'entraînement précédent est supprimé après la bascule.
+        """
         print(" Début de l'entraînement du moteur hybride...")
+        train_kwargs = {
+            'epochs': epochs,
+            'validation_split': validation_split,
+            'patience': patience,
+            'max_time': max_train_time,
+        }
+        start = time.perf_counter()
         
-        print("1. Entraînement du filtrage collaboratif...")
-        self.cf_engine.fit(ratings_df)
+        if parallel:
+            self._fit_parallel(ratings_df, train_kwargs, cf_threads, neural_threads, artifacts_dir)
+        else:
+            print("1. Entraînement du filtrage collaboratif...")
+            step_start = time.perf_counter()
+            self.cf_engine.fit(ratings_df)
+            self.fit_times = {'collaborative': time.perf_counter() - step_start}
+            
+            print("2. Entraînement du modèle neuronal...")
+            step_start = time.perf_counter()
+            self.training_history = self.neural_engine.train(ratings_df, **train_kwargs)
+            self.fit_times['neural'] = time.perf_counter() - step_start
+            # Les moteurs sont désormais entièrement en mémoire : plus aucun fichier mappé
+            self._release_artifacts()
         
-        print("2. Entraînement du modèle neuronal...")
-        self.neural_engine.train(ratings_df, epochs=5)
+        self.popularity.fit(ratings_df, movies_df)
         
+        self.fit_times['total'] = time.perf_counter() - start
         self.is_fitted = True
-        print(" Entraînement terminé!")
+        print(f" Entraînement terminé! (collaboratif: {self.fit_times['collaborative']:.2f}s, "
+              f"neural: {self.fit_times['neural']:.2f}s, total: {self.fit_times['total']:.2f}s)")
+    
+    def _fit_parallel(self, ratings_df: pd.DataFrame, train_kwargs: dict, cf_threads: Optional[int],
+                      neural_threads: Optional[int], artifacts_dir: Optional[str]):
+        """Entraîne les deux moteurs simultanément dans deux processus"""
+        default_threads = max(1, (os.cpu_count() or 2) // 2)
+        cf_threads = cf_threads or default_threads
+        neural_threads = neural_threads or default_threads
+        if artifacts_dir is None:
+            if self._artifacts_root is None:
+                self._artifacts_root = tempfile.mkdtemp(prefix='hybrid_fit_')
+            artifacts_dir = self._artifacts_root
+        os.makedirs(artifacts_dir, exist_ok=True)
+        # Sous-répertoire neuf par entraînement : le moteur servi garde ses fichiers intacts
+        fit_dir = tempfile.mkdtemp(prefix=f'fit-{time.time_ns()}-', dir=artifacts_dir)
+        cf_path = os.path.join(fit_dir, 'collaborative')
+        neural_path = os.path.join(fit_dir, 'neural.pt')
+        
+        print(f"1-2. Entraînement parallèle (collaboratif: {cf_threads} threads, "
+              f"neural: {neural_threads} threads)...")
+        try:
+            # spawn : contrairement aux pools forkés du calcul par lots et de l'entraînement
+            # Hogwild, ces processus ne partagent aucun modèle en mémoire (tout transite par
+            # disque), et forker un processus de service multithreadé (pool de requêtes,
+            # threads torch) risquerait d'hériter de verrous tenus ; seul le démarrage coûte
+            with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+                cf_future = executor.submit(_fit_cf_in_worker, ratings_df, self.cf_engine.get_params(),
+                                            cf_path, cf_threads)
+                neural_future = executor.submit(_train_neural_in_worker, ratings_df,
+                                                self.neural_engine.get_params(), train_kwargs,
+                                                neural_path, neural_threads)
+                cf_result = cf_future.result()
+                neural_result = neural_future.result()
+            cf_engine = CollaborativeFiltering.load(cf_path)
+            neural_engine = NeuralRecommendation().load_checkpoint(neural_path)
+        except BaseException:
+            shutil.rmtree(fit_dir, ignore_errors=True)
+            raise
+        
+        # Bascule vers les nouveaux moteurs, puis suppression de l'entraînement précédent
+        # (les fichiers sont supprimés, jamais tronqués : un mmap encore ouvert reste valide)
+        self.cf_engine = cf_engine
+        self.cf_engine.fit_times = cf_result['fit_times']
+        self.neural_engine = neural_engine
+        previous_dir, self.artifacts_dir = self.artifacts_dir, fit_dir
+        if previous_dir is not None:
+            shutil.rmtree(previous_dir, ignore_errors=True)
+        self.neural_engine.training_stats = neural_result['training_stats']
+        self.neural_engine.training_history = neural_result['history']
+        self.training_history = neural_result['history']
+        self.fit_times = {'collaborative': cf_result['wall_time'], 'neural': neural_result['wall_time']}
     
-    def hybrid_recommend(self, user_id: int, n_recommendations: int = 10) -> List[int]:
-        """Combine les recommandations des deux moteurs"""
+    def _release_artifacts(self):
+        """Supprime les artefacts de l'entraînement parallèle précédent et le répertoire temporaire"""
+        if self.artifacts_dir is not None:
+            shutil.rmtree(self.artifacts_dir, ignore_errors=True)
+            self.artifacts_dir = None
+        if self._artifacts_root is not None:
+            shutil.rmtree(self._artifacts_root, ignore_errors=True)
+            self._artifacts_root = None
+    
+    def hybrid_recommend(self, user_id: int, n_recommendations: int = 10,
+                         return_scores: bool = False, genre: Optional[str] = None,
+                         recent: bool = False):
+        """Combine les recommandations des deux moteurs par fusion de scores.
+
+        Avec return_scores=True, retourne les tableaux (movie_ids, scores fusionnés).
+        Un utilisateur inconnu des deux moteurs reçoit directement les films populaires
+        (du genre demandé s'il est connu, ou de la fenêtre récente si recent=True),
+        sans calcul de modèle.
+        """
         if not self.is_fitted:
             raise ValueError("Le moteur doit être entraîné avant de faire des recommandations")
         
         print(f"🔍 Génération de recommandations pour user {user_id}...")
         
-        cf_recs = self.cf_engine.recommend_for_user(user_id, n_recommendations)
-        print(f"   Collaborative: {cf_recs}")
+        if self._is_cold(user_id):
+            return self._popularity_fallback(user_id, n_recommendations, genre, recent, return_scores)
         
-        neural_recs = self.neural_engine.recommend(user_id, n_recommendations)
-        print(f"   Neural: {neural_recs}")
+        engine_results, self.last_request_stats = self._run_engines(user_id, n_recommendations)
+        print(f"   Collaborative: {engine_results['collaborative'][0].tolist()}")
+        print(f"   Neural: {engine_results['neural'][0].tolist()}")
         
-        combined_recs = []
+        movie_ids, scores = self._fuse(engine_results, n_recommendations)
+        if len(movie_ids) == 0:
+            # Aucun moteur n'a répondu à temps (ou aucun candidat) : repli sur la popularité
+            movie_ids, scores = self.popularity.recommend(n_recommendations, genre=genre, recent=recent,
+                                                          return_scores=True)
+            self.last_request_stats['fallback'] = 'popularity'
         
-        for movie_id in cf_recs:
-            if movie_id not in combined_recs:
-                combined_recs.append(movie_id)
-            if len(combined_recs) >= n_recommendations:
-                break
+        print(f" Recommandations hybrides finales: {movie_ids.tolist()}")
+        if return_scores:
+            return movie_ids, scores
+        return movie_ids.astype(int).tolist()
+    
+    def staged_recommend(self, user_id: int, n_recommendations: int = 10, retriever: str = 'cf',
+                         n_candidates: int = 100, return_scores: bool = False,
+                         evaluate_recall: bool = False, genre: Optional[str] = None,
+                         recent: bool = False):
+        """Pipeline en deux étapes : récupération de candidats puis re-classement neuronal.
+
+        Un récupérateur peu coûteux ('cf' voisinage, 'svd' facteurs latents ou 'popularity')
+        propose n_candidates films non notés ; le modèle neuronal ne note que ces candidats,
+        en une passe. Les durées des étapes sont dans last_request_stats['stages'] ; avec
+        evaluate_recall=True, on y ajoute la part du top-n neuronal exhaustif présente dans
+        les candidats (coûteux, réservé à l'évaluation). Comme pour hybrid_recommend, un
+        utilisateur inconnu reçoit les films populaires (genre, recent) sans calcul de modèle.
+        """
+        if not self.is_fitted:
+            raise ValueError("Le moteur doit être entraîné avant de faire des recommandations")
+        if self._is_cold(user_id):
+            return self._popularity_fallback(user_id, n_recommendations, genre, recent, return_scores)
+        
+        start = time.perf_counter()
+        candidates, candidate_scores = self._retrieve(user_id, retriever, n_candidates)
+        retrieval_time = time.perf_counter() - start
+        
+        if len(candidates) == 0:
+            # Utilisateur ayant tout noté : mêmes films populaires que hybrid_recommend
+            return self._popularity_fallback(user_id, n_recommendations, genre, recent, return_scores)
+        
+        scores = self.neural_engine.score_movies(user_id, candidates)
+        ranked = np.isfinite(scores)
+        if ranked.any():
+            candidates, scores = candidates[ranked], scores[ranked]
+            best = top_k(scores, n_recommendations)
+        else:
+            # Utilisateur inconnu du modèle neuronal : ordre du récupérateur (complément inclus)
+            scores = candidate_scores
+            best = np.arange(min(n_recommendations, len(candidates)))
+        movie_ids, best_scores = candidates[best], scores[best]
+        ranking_time = time.perf_counter() - start - retrieval_time
         
-        if len(combined_recs) < n_recommendations:
-            for movie_id in neural_recs:
-                if movie_id not in combined_recs:
-                    combined_recs.append(movie_id)
-                if len(combined_recs) >= n_recommendations:
-                    break
+        self.last_request_stats = {
+            'retriever': retriever,
+            'n_candidates': len(candidates),
+            'stages': {'retrieval': retrieval_time, 'ranking': ranking_time},
+            'total_time': time.perf_counter() - start,
+        }
+        if evaluate_recall:
+            exhaustive = self.neural_engine.recommend(user_id, n_recommendations, exclude_rated=True)
+            self.last_request_stats['candidate_recall'] = (
+                float(np.isin(exhaustive, candidates).mean()) if exhaustive else None
+            )
+        
+        print(f" Recommandations en deux étapes ({retriever}, {len(candidates)} candidats) "
+              f"pour user {user_id}: {movie_ids.tolist()}")
+        if return_scores:
+            return movie_ids, best_scores
+        return movie_ids.astype(int).tolist()
+    
+    def _is_cold(self, user_id: int) -> bool:
+        """Utilisateur sans historique dans aucun des deux moteurs"""
+        return user_id not in self.cf_engine.user_encoder and user_id not in self.neural_engine.user_encoder
+    
+    def _popularity_fallback(self, user_id: int, n_recommendations: int, genre: Optional[str],
+                             recent: bool, return_scores: bool):
+        """Réponse précalculée de l'index de popularité, sans calcul de modèle"""
+        movie_ids, scores = self.popularity.recommend(n_recommendations, genre=genre, recent=recent,
+                                                      return_scores=True)
+        self.last_request_stats = {'fallback': 'popularity'}
+        print(f" Utilisateur {user_id} inconnu, recommandations populaires: {movie_ids.tolist()}")
+        return (movie_ids, scores) if return_scores else movie_ids.astype(int).tolist()
+    
+    def _retrieve(self, user_id: int, retriever: str, n_candidates: int):
+        """Candidats (movie_ids, scores) non notés par l'utilisateur, du récupérateur choisi.
+
+        Le voisinage 'cf' ne propose que les films bien notés par les voisins : quand un
+        récupérateur rend moins de n_candidates films, on complète avec les films populaires
+        non notés, placés après ses propres candidats.
+        """
+        if retriever == 'popularity':
+            return self._popular_unrated(user_id, n_candidates)
+        if retriever not in ('cf', 'svd'):
+            raise ValueError(f"Récupérateur inconnu: {retriever}")
+        
+        mode = 'user' if retriever == 'cf' else 'svd'
+        movie_ids, scores = self.cf_engine.recommend_for_user(user_id, n_candidates, return_scores=True,
+                                                              mode=mode)
+        missing = n_candidates - len(movie_ids)
+        if missing > 0:
+            extra_ids, extra_scores = self._popular_unrated(user_id, n_candidates + len(movie_ids))
+            extra = np.flatnonzero(~np.isin(extra_ids, movie_ids))[:missing]
+            movie_ids = np.concatenate([np.asarray(movie_ids, dtype=np.int64), extra_ids[extra]])
+            scores = np.concatenate([np.asarray(scores, dtype=np.float32), extra_scores[extra]])
+        return movie_ids, scores
+    
+    def _popular_unrated(self, user_id: int, n_candidates: int):
+        """Films les plus populaires que l'utilisateur n'a pas notés"""
+        user_idx = self.cf_engine.user_encoder.get(user_id)
+        if user_idx is None:
+            return self.popularity.recommend(n_candidates, return_scores=True)
+        rated = self.cf_engine.movie_encoder.decode(self.cf_engine.user_item_matrix[user_idx].indices)
+        unrated = np.flatnonzero(~np.isin(self.popularity.movie_ids, rated))[:n_candidates]
+        return self.popularity.movie_ids[unrated], self.popularity.scores[unrated]
+    
+    def _fuse(self, engine_results: dict, n_recommendations: int):
+        """Fusionne les (ids, scores) des moteurs en une passe : np.unique + bincount puis top-k"""
+        all_ids, contributions = [], []
+        for name, (movie_ids, scores) in engine_results.items():
+            if len(movie_ids) == 0:
+                continue
+            weight = self.fusion_weights.get(name, 0.0)
+            if self.fusion == 'rrf':
+                contribution = weight / (self.rrf_k + np.arange(1, len(movie_ids) + 1))
+            else:
+                # Normalisation min-max : les échelles des deux moteurs deviennent comparables
+                scores = np.asarray(scores, dtype=np.float64)
+                spread = scores.max() - scores.min()
+                normalized = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+                contribution = weight * normalized
+            all_ids.append(np.asarray(movie_ids, dtype=np.int64))
+            contributions.append(contribution)
+        
+        if not all_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        
+        unique_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        fused = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids))
+        best = top_k(fused, n_recommendations)
+        return unique_ids[best], fused[best]
+    
+    def _run_engines(self, user_id: int, n_recommendations: int) -> Tuple[dict, dict]:
+        """Lance les deux moteurs en parallèle ; un moteur hors délai ne contribue aucun film.
+
+        Retourne (résultats par moteur, statistiques de la requête).
+        """
+        start = time.perf_counter()
+        futures = {
+            'collaborative': self.executor.submit(
+                self.cf_engine.recommend_for_user, user_id, n_recommendations, return_scores=True),
+            'neural': self.executor.submit(
+                self.neural_engine.recommend, user_id, n_recommendations,
+                exclude_rated=True, return_scores=True),
+        }
         
-        if len(combined_recs) < n_recommendations:
-            pass
+        results, latencies, timed_out = {}, {}, []
+        for name, future in futures.items():
+            timeout = self.engine_timeouts[name]
+            remaining = None if timeout is None else max(0.0, timeout - (time.perf_counter() - start))
+            try:
+                results[name] = future.result(timeout=remaining)
+                latencies[name] = time.perf_counter() - start
+            except FutureTimeoutError:
+                # Une tâche encore en file est annulée ; déjà démarrée, elle se termine
+                # en arrière-plan et son résultat est ignoré
+                future.cancel()
+                print(f"⚠️ Moteur {name} hors délai ({timeout}s), repli sur l'autre moteur")
+                results[name] = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+                timed_out.append(name)
+                with self._timeout_lock:
+                    self.timeout_counts[name] += 1
         
-        print(f" Recommandations hybrides finales: {combined_recs}")
-        return combined_recs[:n_recommendations]
\ No newline at end of file
+        stats = {
+            'latency': latencies,
+            'timed_out': timed_out,
+            'total_time': time.perf_counter() - start,
+        }
+        return results, stats
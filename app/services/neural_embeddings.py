@@ -1,15 +1,30 @@
+import copy
+import io
+import json
+import os
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.optim as optim
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler, TensorDataset
 import numpy as np
+import time
 import pandas as pd
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from app.services.numpy_scorer import NUMPY_FORMAT_VERSION
+from app.utils.id_encoder import IdEncoder
+
+# Version du format des checkpoints d'entraînement
+CHECKPOINT_FORMAT_VERSION = 2
 
 class NeuralEmbeddingModel(nn.Module):
-    def __init__(self, n_users: int, n_movies: int, embedding_dim: int = 20):  # Réduit la dimension
+    def __init__(self, n_users: int, n_movies: int, embedding_dim: int = 20,  # Réduit la dimension
+                 sparse: bool = False):
         super(NeuralEmbeddingModel, self).__init__()
-        self.user_embedding = nn.Embedding(n_users, embedding_dim)
-        self.movie_embedding = nn.Embedding(n_movies, embedding_dim)
+        # sparse=True : gradients creux, seules les lignes du batch sont mises à jour
+        self.user_embedding = nn.Embedding(n_users, embedding_dim, sparse=sparse)
+        self.movie_embedding = nn.Embedding(n_movies, embedding_dim, sparse=sparse)
         self.fc_layers = nn.Sequential(
             nn.Linear(embedding_dim * 2, 64),
             nn.ReLU(),
@@ -24,80 +39,661 @@ class NeuralEmbeddingModel(nn.Module):
         user_embed = self.user_embedding(user_ids)
         movie_embed = self.movie_embedding(movie_ids)
         x = torch.cat([user_embed, movie_embed], dim=1)
-        return self.fc_layers(x).squeeze()
+        return self.fc_layers(x).squeeze(-1)
+    
+    def grow(self, n_users: int, n_movies: int):
+        """Agrandit les tables d'embedding en place pour de nouveaux identifiants.
 
-class NeuralRecommendation:
-    def __init__(self):
-        self.model = None
-        self.user_id_map = {}
-        self.movie_id_map = {}
-        self.reverse_movie_map = {}  # Map inverse pour retrouver les vrais IDs
+        Les lignes existantes sont conservées, les nouvelles initialisées comme nn.Embedding.
+        Les objets Parameter restent les mêmes : l'optimiseur continue de les suivre.
+        Retourne la liste (paramètre, ancien nombre de lignes) des tables agrandies.
+        """
+        grown = []
+        for embedding, n_rows in [(self.user_embedding, n_users), (self.movie_embedding, n_movies)]:
+            n_before = embedding.num_embeddings
+            if n_rows <= n_before:
+                continue
+            new_rows = torch.empty(n_rows - n_before, embedding.embedding_dim)
+            nn.init.normal_(new_rows)
+            embedding.weight.data = torch.cat([embedding.weight.data, new_rows])
+            embedding.num_embeddings = n_rows
+            grown.append((embedding.weight, n_before))
+        return grown
+
+def build_optimizers(model: NeuralEmbeddingModel, learning_rate: float,
+                     sparse_embeddings: bool = False) -> List[optim.Optimizer]:
+    """Adam dense, ou SparseAdam pour les embeddings creux et Adam pour fc_layers"""
+    if not sparse_embeddings:
+        return [optim.Adam(model.parameters(), lr=learning_rate)]
+    embedding_params = [model.user_embedding.weight, model.movie_embedding.weight]
+    return [
+        optim.SparseAdam(embedding_params, lr=learning_rate),
+        optim.Adam(model.fc_layers.parameters(), lr=learning_rate),
+    ]
+
+def _hogwild_worker(rank, model, users, movies, ratings, epochs, batch_size, learning_rate,
+                    sparse_embeddings, n_threads, cpus, results):
+    """Boucle d'entraînement d'un processus Hogwild sur son fragment de données"""
+    torch.set_num_threads(n_threads)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch.manual_seed(rank)
+    
+    optimizers = build_optimizers(model, learning_rate, sparse_embeddings)
+    criterion = nn.MSELoss()
+    start = time.perf_counter()
+    n_samples = 0
+    for _ in range(epochs):
+        for batch in torch.randperm(len(ratings)).split(batch_size):
+            for optimizer in optimizers:
+                optimizer.zero_grad()
+            loss = criterion(model(users[batch], movies[batch]), ratings[batch])
+            loss.backward()
+            for optimizer in optimizers:
+                optimizer.step()
+            n_samples += len(batch)
+    results.put((rank, n_samples, time.perf_counter() - start))
+
+class ItemTowerScorer(nn.Module):
+    """Scoreur d'inférence avec la contribution des films précalculée.
+
+    La première couche sur [user_embed, movie_embed] se décompose en
+    W_u·user_embed + (W_m·movie_embed + b) : la partie film est calculée une fois
+    pour tout le catalogue, il ne reste par utilisateur qu'un petit produit
+    matrice-vecteur suivi des couches restantes (sans Dropout).
+    """
+    def __init__(self, model: NeuralEmbeddingModel):
+        super(ItemTowerScorer, self).__init__()
+        first_layer = model.fc_layers[0]
+        embedding_dim = model.user_embedding.embedding_dim
         
-    def train(self, ratings_df: pd.DataFrame, epochs: int = 5):  # Réduit les epochs
-        """Entraîne le modèle neuronal"""
-        # Préparation des données
-        unique_users = sorted(ratings_df['user_id'].unique())
-        unique_movies = sorted(ratings_df['movie_id'].unique())
+        with torch.no_grad():
+            self.user_embedding = nn.Embedding.from_pretrained(model.user_embedding.weight.detach().clone())
+            self.user_projection = nn.Linear(embedding_dim, first_layer.out_features, bias=False)
+            self.user_projection.weight.copy_(first_layer.weight[:, :embedding_dim])
+            self.register_buffer(
+                'item_part',
+                model.movie_embedding.weight @ first_layer.weight[:, embedding_dim:].T + first_layer.bias
+            )
         
-        self.user_id_map = {uid: idx for idx, uid in enumerate(unique_users)}
-        self.movie_id_map = {mid: idx for idx, mid in enumerate(unique_movies)}
-        self.reverse_movie_map = {idx: mid for mid, idx in self.movie_id_map.items()}
+        self.head = nn.Sequential(*[
+            copy.deepcopy(layer) for layer in model.fc_layers[1:]
+            if not isinstance(layer, nn.Dropout)
+        ])
+        self.eval()
         
-        n_users = len(unique_users)
-        n_movies = len(unique_movies)
+    def forward(self, user_ids: torch.Tensor, movie_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Scores (n_users, n_movies) ; tout le catalogue si movie_ids est None"""
+        user_part = self.user_projection(self.user_embedding(user_ids))
+        item_part = self.item_part if movie_ids is None else self.item_part[movie_ids]
+        hidden = user_part.unsqueeze(1) + item_part.unsqueeze(0)
+        return self.head(hidden).squeeze(-1)
+
+class NeuralRecommendation:
+    def __init__(self, embedding_dim: int = 20, learning_rate: float = 0.001,
+                 sparse_embeddings: bool = False):
+        self.embedding_dim = embedding_dim
+        self.learning_rate = learning_rate
+        # Embeddings creux + SparseAdam : coût par pas proportionnel au batch, pas aux tables
+        self.sparse_embeddings = sparse_embeddings
+        self.model = None
+        self.optimizers = []  # conservés entre deux entraînements pour le warm start
+        self.user_encoder = IdEncoder()
+        self.movie_encoder = IdEncoder()  # decode() retrouve les vrais IDs de films
+        self.scorer = None  # ItemTowerScorer, reconstruit après chaque entraînement
+        # Films notés par utilisateur, au format CSR : rated_movies[rated_offsets[u]:rated_offsets[u + 1]]
+        self.rated_offsets = None
+        self.rated_movies = None
+        self.training_stats = {}
+        self.training_history = {}
+    
+    def get_params(self) -> dict:
+        """Paramètres du constructeur, pour recréer un moteur configuré à l'identique"""
+        return {
+            'embedding_dim': self.embedding_dim,
+            'learning_rate': self.learning_rate,
+            'sparse_embeddings': self.sparse_embeddings,
+        }
+    
+    @property
+    def user_id_map(self) -> dict:
+        """Vue dict user_id -> indice (compatibilité, construite à la demande)"""
+        return dict(zip(self.user_encoder.ids.tolist(), range(len(self.user_encoder))))
+    
+    @property
+    def movie_id_map(self) -> dict:
+        """Vue dict movie_id -> indice (compatibilité, construite à la demande)"""
+        return dict(zip(self.movie_encoder.ids.tolist(), range(len(self.movie_encoder))))
+    
+    @property
+    def reverse_movie_map(self) -> dict:
+        """Vue dict indice -> movie_id (compatibilité, construite à la demande)"""
+        return dict(enumerate(self.movie_encoder.ids.tolist()))
         
-        print(f" Entraînement neural: {n_users} users, {n_movies} movies")
+    def train(self, ratings_df: pd.DataFrame, epochs: int = 5, batch_size: int = 1024,
+              shuffle: bool = True, num_workers: int = 0, warm_start: bool = False,
+              validation_split: float = 0.0, patience: Optional[int] = None,
+              min_delta: float = 0.0, max_time: Optional[float] = None,
+              random_state: int = 42) -> dict:
+        """Entraîne le modèle neuronal par mini-batchs.
+
+        Avec warm_start=True, l'entraînement repart du modèle et de l'optimiseur courants :
+        les nouveaux utilisateurs et films agrandissent les tables d'embedding.
+
+        validation_split réserve une fraction des notes pour mesurer le RMSE à chaque epoch ;
+        avec patience, l'entraînement s'arrête après `patience` epochs sans amélioration
+        d'au moins min_delta et les meilleurs poids sont restaurés. max_time (secondes)
+        borne la durée totale. Retourne l'historique d'entraînement.
+        """
+        if not 0 <= validation_split < 1:
+            raise ValueError(f"validation_split doit être dans [0, 1): {validation_split}")
         
-        # Initialisation du modèle
-        self.model = NeuralEmbeddingModel(n_users, n_movies, embedding_dim=20)
+        users_tensor, movies_tensor, ratings_tensor = self._prepare_training(ratings_df, warm_start)
         criterion = nn.MSELoss()
-        optimizer = optim.Adam(self.model.parameters(), lr=0.001)
         
-        # Conversion des données
-        user_indices = [self.user_id_map[uid] for uid in ratings_df['user_id']]
-        movie_indices = [self.movie_id_map[mid] for mid in ratings_df['movie_id']]
+        # Séparation entraînement / validation
+        n_ratings = len(ratings_tensor)
+        n_val = int(n_ratings * validation_split)
+        if n_val > 0:
+            generator = torch.Generator().manual_seed(random_state)
+            permutation = torch.randperm(n_ratings, generator=generator)
+            val_idx, train_idx = permutation[:n_val], permutation[n_val:]
+            val_data = (users_tensor[val_idx], movies_tensor[val_idx], ratings_tensor[val_idx])
+            users_tensor, movies_tensor, ratings_tensor = (
+                users_tensor[train_idx], movies_tensor[train_idx], ratings_tensor[train_idx]
+            )
+        else:
+            val_data = None
         
-        users_tensor = torch.tensor(user_indices, dtype=torch.long)
-        movies_tensor = torch.tensor(movie_indices, dtype=torch.long)
-        ratings_tensor = torch.tensor(ratings_df['rating'].values, dtype=torch.float32)
+        # Chaque élément du sampler est une liste d'indices : le batch est extrait
+        # en une seule indexation des tenseurs contigus, sans collation élément par élément
+        dataset = TensorDataset(users_tensor, movies_tensor, ratings_tensor)
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        loader = DataLoader(
+            dataset,
+            sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False),
+            batch_size=None,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0
+        )
         
         # Entraînement
-        self.model.train()
+        history = {'epochs': [], 'best_epoch': None, 'best_val_rmse': None, 'stop_reason': 'max_epochs'}
+        best_state = None
+        epochs_without_improvement = 0
+        n_trained = 0
+        train_start = time.perf_counter()
         for epoch in range(epochs):
-            optimizer.zero_grad()
-            predictions = self.model(users_tensor, movies_tensor)
-            loss = criterion(predictions, ratings_tensor)
-            loss.backward()
-            optimizer.step()
+            self.model.train()
+            epoch_start = time.perf_counter()
+            epoch_loss = 0.0
+            n_samples = 0
+            for batch_users, batch_movies, batch_ratings in loader:
+                if max_time is not None and time.perf_counter() - train_start > max_time:
+                    history['stop_reason'] = 'time_budget'
+                    break
+                for optimizer in self.optimizers:
+                    optimizer.zero_grad()
+                predictions = self.model(batch_users, batch_movies)
+                loss = criterion(predictions, batch_ratings)
+                loss.backward()
+                for optimizer in self.optimizers:
+                    optimizer.step()
+                
+                epoch_loss += loss.item() * len(batch_ratings)
+                n_samples += len(batch_ratings)
+            
+            if n_samples == 0:
+                break
+            n_trained += n_samples
+            epoch_time = time.perf_counter() - epoch_start
+            record = {
+                'epoch': epoch,
+                'train_loss': epoch_loss / n_samples,
+                'val_rmse': self._validation_rmse(*val_data) if val_data is not None else None,
+                'samples_per_sec': n_samples / epoch_time if epoch_time > 0 else 0.0,
+                'elapsed': time.perf_counter() - train_start,
+            }
+            history['epochs'].append(record)
             
-            if epoch % 2 == 0:
-                print(f"Epoch {epoch}, Loss: {loss.item():.4f}")
+            if epoch % 2 == 0 or val_data is not None:
+                val_info = f", Val RMSE: {record['val_rmse']:.4f}" if val_data is not None else ""
+                print(f"Epoch {epoch}, Loss: {record['train_loss']:.4f}{val_info}, "
+                      f"{record['samples_per_sec']:.0f} samples/s")
+            
+            if history['stop_reason'] == 'time_budget':
+                break
+            
+            if val_data is not None:
+                if history['best_val_rmse'] is None or record['val_rmse'] < history['best_val_rmse'] - min_delta:
+                    history['best_epoch'] = epoch
+                    history['best_val_rmse'] = record['val_rmse']
+                    epochs_without_improvement = 0
+                    if patience is not None:
+                        best_state = copy.deepcopy(self.model.state_dict())
+                else:
+                    epochs_without_improvement += 1
+                    if patience is not None and epochs_without_improvement >= patience:
+                        history['stop_reason'] = 'early_stopping'
+                        break
+        
+        # Retour aux meilleurs poids observés sur la validation
+        if best_state is not None and history['best_epoch'] != history['epochs'][-1]['epoch']:
+            self.model.load_state_dict(best_state)
+            print(f" Meilleurs poids restaurés (epoch {history['best_epoch']})")
+        
+        train_time = time.perf_counter() - train_start
+        history['train_time'] = train_time
+        self.training_stats = {
+            'epochs': len(history['epochs']),
+            'batch_size': batch_size,
+            'n_samples': len(dataset),
+            'n_validation': n_val,
+            'train_time': train_time,
+            'samples_per_sec': n_trained / train_time if train_time > 0 else 0.0,
+            'stop_reason': history['stop_reason'],
+        }
+        print(f" Débit d'entraînement: {self.training_stats['samples_per_sec']:.0f} samples/s "
+              f"({self.training_stats['epochs']} epochs, arrêt: {history['stop_reason']})")
+        
+        self.model.eval()
+        self.scorer = ItemTowerScorer(self.model)
+        self.training_history = history
+        return history
     
-    def recommend(self, user_id: int, n_recommendations: int = 10) -> List[int]:
-        """Génère des recommandations avec le modèle neuronal"""
-        if user_id not in self.user_id_map:
-            print(f"⚠️ Utilisateur {user_id} non trouvé dans le modèle neural")
-            return []
+    def _validation_rmse(self, users: torch.Tensor, movies: torch.Tensor, ratings: torch.Tensor,
+                         batch_size: int = 65536) -> float:
+        """RMSE du modèle courant sur les notes de validation"""
+        self.model.eval()
+        squared_error = 0.0
+        with torch.no_grad():
+            for start in range(0, len(ratings), batch_size):
+                end = start + batch_size
+                predictions = self.model(users[start:end], movies[start:end])
+                squared_error += torch.sum((predictions - ratings[start:end]) ** 2).item()
+        return float(np.sqrt(squared_error / len(ratings)))
+    
+    def _prepare_training(self, ratings_df: pd.DataFrame, warm_start: bool = False):
+        """Encode les données, prépare modèle et optimiseurs ; retourne les tenseurs d'entraînement"""
+        # Le cache de la partie film devient invalide dès que les poids changent
+        self.scorer = None
+        warm_start = warm_start and self.model is not None
+        
+        # Préparation des données : encodage vectorisé des identifiants
+        if not warm_start:
+            self.user_encoder = IdEncoder()
+            self.movie_encoder = IdEncoder()
+        n_users_before, n_movies_before = len(self.user_encoder), len(self.movie_encoder)
+        user_indices = self.user_encoder.extend(ratings_df['user_id'].to_numpy())
+        movie_indices = self.movie_encoder.extend(ratings_df['movie_id'].to_numpy())
+        
+        n_users = len(self.user_encoder)
+        n_movies = len(self.movie_encoder)
+        
+        if warm_start:
+            print(f" Entraînement neural (warm start): {n_users} users "
+                  f"(+{n_users - n_users_before}), {n_movies} movies (+{n_movies - n_movies_before})")
+            for parameter, n_before in self.model.grow(n_users, n_movies):
+                self._grow_optimizer_state(parameter, n_before)
+        else:
+            print(f" Entraînement neural: {n_users} users, {n_movies} movies")
             
-        user_idx = self.user_id_map[user_id]
+            # Initialisation du modèle
+            self.model = NeuralEmbeddingModel(n_users, n_movies, embedding_dim=self.embedding_dim,
+                                              sparse=self.sparse_embeddings)
+            self.optimizers = self._build_optimizers()
+        
+        # Masque des films déjà notés, précalculé pour le service
+        self._update_rated_movies(user_indices, movie_indices, merge=warm_start)
         
-        # Films déjà notés par l'utilisateur (à exclure)
-        # Pour l'instant, on recommande tous les films non notés
+        # Conversion des données
+        return (
+            torch.from_numpy(user_indices),
+            torch.from_numpy(movie_indices),
+            torch.tensor(ratings_df['rating'].values, dtype=torch.float32),
+        )
+    
+    def train_parallel(self, ratings_df: pd.DataFrame, n_workers: int = 4, epochs: int = 5,
+                       batch_size: int = 1024, threads_per_worker: int = 1,
+                       pin_threads: bool = True, warm_start: bool = False):
+        """Entraînement Hogwild : plusieurs processus mettent à jour un modèle en mémoire partagée.
+
+        Chaque processus parcourt un fragment disjoint des données avec son propre
+        optimiseur, sans verrou. `threads_per_worker` fixe les threads torch de chaque
+        processus ; avec `pin_threads`, chaque processus est épinglé sur ses propres cœurs.
+        """
+        users_tensor, movies_tensor, ratings_tensor = self._prepare_training(ratings_df, warm_start)
+        self.model.train()
+        self.model.share_memory()
         
-        # Prédire les ratings pour tous les films
-        user_tensor = torch.tensor([user_idx] * len(self.movie_id_map), dtype=torch.long)
-        movie_tensors = torch.tensor(list(self.movie_id_map.values()), dtype=torch.long)
+        shards = torch.randperm(len(ratings_tensor)).chunk(n_workers)
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        
+        context = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        results = context.SimpleQueue()
+        workers = []
+        train_start = time.perf_counter()
+        for rank, shard in enumerate(shards):
+            worker_cpus = []
+            if pin_threads and cpus:
+                worker_cpus = [cpus[(rank * threads_per_worker + i) % len(cpus)]
+                               for i in range(threads_per_worker)]
+            worker = context.Process(target=_hogwild_worker, args=(
+                rank, self.model, users_tensor[shard], movies_tensor[shard], ratings_tensor[shard],
+                epochs, batch_size, self.learning_rate, self.sparse_embeddings,
+                threads_per_worker, worker_cpus, results
+            ))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        train_time = time.perf_counter() - train_start
+        
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError("Un processus d'entraînement Hogwild a échoué")
+        worker_stats = sorted(results.get() for _ in workers)
+        
+        n_samples = epochs * len(ratings_tensor)
+        self.training_stats = {
+            'epochs': epochs,
+            'batch_size': batch_size,
+            'n_samples': len(ratings_tensor),
+            'n_workers': len(workers),
+            'threads_per_worker': threads_per_worker,
+            'train_time': train_time,
+            'samples_per_sec': n_samples / train_time if train_time > 0 else 0.0,
+            'worker_samples_per_sec': [samples / elapsed for _, samples, elapsed in worker_stats],
+        }
+        print(f" Entraînement Hogwild: {len(workers)} processus, "
+              f"{self.training_stats['samples_per_sec']:.0f} samples/s")
+        
+        self.model.eval()
+        self.scorer = ItemTowerScorer(self.model)
+    
+    def _build_optimizers(self) -> List[optim.Optimizer]:
+        return build_optimizers(self.model, self.learning_rate, self.sparse_embeddings)
+    
+    def _grow_optimizer_state(self, parameter: nn.Parameter, n_before: int):
+        """Complète par des zéros les moments de l'optimiseur d'une table agrandie"""
+        state = {}
+        for optimizer in self.optimizers:
+            state = optimizer.state.get(parameter, state)
+        for key, value in state.items():
+            if torch.is_tensor(value) and value.dim() == parameter.dim() and value.shape[0] == n_before:
+                padding = torch.zeros((parameter.shape[0] - n_before,) + tuple(value.shape[1:]),
+                                      dtype=value.dtype)
+                state[key] = torch.cat([value, padding])
+    
+    def _update_rated_movies(self, user_indices: np.ndarray, movie_indices: np.ndarray,
+                             merge: bool = False):
+        """Reconstruit le CSR des films notés, en conservant l'existant si `merge`"""
+        n_users = len(self.user_encoder)
+        if merge and self.rated_offsets is not None:
+            counts = torch.diff(self.rated_offsets).numpy()
+            user_indices = np.concatenate([np.repeat(np.arange(len(counts)), counts), user_indices])
+            movie_indices = np.concatenate([self.rated_movies.numpy(), movie_indices])
+            pairs = np.unique(user_indices * len(self.movie_encoder) + movie_indices)
+            user_indices, movie_indices = np.divmod(pairs, len(self.movie_encoder))
+        
+        order = np.argsort(user_indices, kind='stable')
+        self.rated_movies = torch.from_numpy(np.ascontiguousarray(movie_indices[order]))
+        self.rated_offsets = torch.from_numpy(
+            np.concatenate([[0], np.cumsum(np.bincount(user_indices, minlength=n_users))])
+        )
+    
+    def save_checkpoint(self, path: str):
+        """Sauvegarde modèle, optimiseur et encodeurs pour reprendre l'entraînement"""
+        torch.save({
+            'format_version': CHECKPOINT_FORMAT_VERSION,
+            'embedding_dim': self.embedding_dim,
+            'learning_rate': self.learning_rate,
+            'sparse_embeddings': self.sparse_embeddings,
+            'model_state': self.model.state_dict(),
+            'optimizer_states': [optimizer.state_dict() for optimizer in self.optimizers],
+            'user_ids': self.user_encoder.ids,
+            'movie_ids': self.movie_encoder.ids,
+            'rated_offsets': self.rated_offsets,
+            'rated_movies': self.rated_movies,
+        }, path)
+        print(f" Checkpoint neural sauvegardé dans {path}")
+        return path
+    
+    def load_checkpoint(self, path: str):
+        """Restaure un checkpoint ; un `train(..., warm_start=True)` peut ensuite le prolonger"""
+        checkpoint = torch.load(path, weights_only=False)
+        if checkpoint['format_version'] != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f"Version de checkpoint non supportée: {checkpoint['format_version']}")
+        
+        self.embedding_dim = checkpoint['embedding_dim']
+        self.learning_rate = checkpoint['learning_rate']
+        self.sparse_embeddings = checkpoint['sparse_embeddings']
+        self.user_encoder = IdEncoder.from_arrays(checkpoint['user_ids'])
+        self.movie_encoder = IdEncoder.from_arrays(checkpoint['movie_ids'])
+        self.rated_offsets = checkpoint['rated_offsets']
+        self.rated_movies = checkpoint['rated_movies']
+        
+        self.model = NeuralEmbeddingModel(len(self.user_encoder), len(self.movie_encoder),
+                                          embedding_dim=self.embedding_dim,
+                                          sparse=self.sparse_embeddings)
+        self.model.load_state_dict(checkpoint['model_state'])
+        self.optimizers = self._build_optimizers()
+        for optimizer, state in zip(self.optimizers, checkpoint['optimizer_states']):
+            optimizer.load_state_dict(state)
         
         self.model.eval()
+        self.scorer = ItemTowerScorer(self.model)
+        print(f" Checkpoint neural chargé depuis {path}")
+        return self
+    
+    def recommend(self, user_id: int, n_recommendations: int = 10,
+                  exclude_rated: bool = True, return_scores: bool = False):
+        """Génère des recommandations avec le modèle neuronal.
+
+        Avec return_scores=True, retourne les tableaux (movie_ids, scores) triés
+        par score décroissant.
+        """
+        if user_id not in self.user_encoder:
+            print(f"⚠️ Utilisateur {user_id} non trouvé dans le modèle neural")
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) if return_scores else []
+        
+        movie_ids, scores = self.recommend_batch([user_id], n_recommendations, exclude_rated)
+        valid = movie_ids[0] >= 0
+        movie_ids, scores = movie_ids[0][valid], scores[0][valid]
+        
+        print(f" Recommandations neurales pour user {user_id}: {movie_ids.tolist()}")
+        if return_scores:
+            return movie_ids, scores
+        return movie_ids.astype(int).tolist()
+    
+    def recommend_batch(self, user_ids, n_recommendations: int = 10, exclude_rated: bool = True,
+                        chunk_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Recommandations pour un bloc d'utilisateurs en une passe par bloc.
+
+        Retourne (movie_ids, scores) de forme (len(user_ids), n_recommendations) ;
+        les cases vides valent -1 (ids) et NaN (scores), notamment pour les utilisateurs inconnus.
+        """
+        user_idx = self.user_encoder.encode(np.asarray(user_ids))
+        known = np.flatnonzero(user_idx >= 0)
+        n_movies = len(self.movie_encoder)
+        n_recommendations = min(n_recommendations, n_movies)
+        
+        movie_ids = np.full((len(user_idx), n_recommendations), -1, dtype=np.int64)
+        scores = np.full((len(user_idx), n_recommendations), np.nan, dtype=np.float32)
+        if n_movies == 0:  # modèle non entraîné : rien à classer
+            return movie_ids, scores
+        # Taille de bloc par défaut : ~1M couples (utilisateur, film) par passe
+        chunk_size = chunk_size or max(1, 2 ** 20 // n_movies)
+        
+        for start in range(0, len(known), chunk_size):
+            rows = known[start:start + chunk_size]
+            users = torch.from_numpy(user_idx[rows])
+            with torch.no_grad():
+                predictions = self.scorer(users)
+            if exclude_rated:
+                predictions[self._rated_mask(users)] = -np.inf
+            
+            top_scores, top_indices = torch.topk(predictions, n_recommendations, dim=1)
+            top_scores, top_indices = top_scores.numpy(), top_indices.numpy()
+            valid = np.isfinite(top_scores)
+            movie_ids[rows] = np.where(valid, self.movie_encoder.decode(top_indices), -1)
+            scores[rows] = np.where(valid, top_scores, np.nan)
+        
+        return movie_ids, scores
+    
+    def score_movies(self, user_id: int, movie_ids) -> np.ndarray:
+        """Scores d'un utilisateur pour une liste de films, en une seule passe du scoreur.
+
+        Le coût dépend du nombre de films demandés et non de la taille du catalogue ;
+        NaN pour les films inconnus (ou pour tous si l'utilisateur est inconnu).
+        """
+        movie_idx = self.movie_encoder.encode(np.asarray(movie_ids))
+        scores = np.full(len(movie_idx), np.nan, dtype=np.float32)
+        user_idx = self.user_encoder.get(user_id)
+        known = movie_idx >= 0
+        if user_idx is None or not known.any():
+            return scores
+        
         with torch.no_grad():
-            predictions = self.model(user_tensor, movie_tensors)
+            predictions = self.scorer(torch.tensor([user_idx]), torch.from_numpy(movie_idx[known]))
+        scores[known] = predictions[0].numpy()
+        return scores
+    
+    def _rated_mask(self, users: torch.Tensor):
+        """Positions (ligne, film) des films déjà notés par un bloc d'utilisateurs"""
+        starts = self.rated_offsets[users]
+        counts = self.rated_offsets[users + 1] - starts
+        rows = torch.repeat_interleave(torch.arange(len(users)), counts)
+        # Position de chaque note dans rated_movies : début de la ligne + rang dans la ligne
+        first = torch.cumsum(counts, 0) - counts
+        positions = torch.arange(int(counts.sum())) - torch.repeat_interleave(first - starts, counts)
+        return rows, self.rated_movies[positions]
+    
+    def export_inference_model(self, path: str, quantize: bool = True,
+                               eval_df: Optional[pd.DataFrame] = None) -> dict:
+        """Exporte un artefact d'inférence CPU : TorchScript figé, int8 dynamique en option.
+
+        Les encodeurs d'identifiants et le masque des films notés sont embarqués
+        dans le fichier. Retourne l'écart de précision par rapport au modèle float32.
+        """
+        scorer = ItemTowerScorer(self.model)
+        if quantize:
+            # Poids int8, activations quantifiées à la volée : couches linéaires uniquement
+            scorer = torch.ao.quantization.quantize_dynamic(scorer, {nn.Linear}, dtype=torch.qint8)
+        exported = torch.jit.freeze(torch.jit.script(scorer.eval()))
+        
+        extra_files = {
+            name: self._array_bytes(array) for name, array in [
+                ('user_ids', self.user_encoder.ids),
+                ('movie_ids', self.movie_encoder.ids),
+                ('rated_offsets', self.rated_offsets.numpy()),
+                ('rated_movies', self.rated_movies.numpy()),
+            ]
+        }
+        torch.jit.save(exported, path, _extra_files=extra_files)
+        
+        report = self._accuracy_drift(exported, eval_df)
+        report['quantized'] = quantize
+        print(f" Modèle d'inférence exporté dans {path} "
+              f"(écart RMSE des scores vs float32: {report['score_rmse_drift']:.4f})")
+        return report
+    
+    def export_numpy(self, path: str) -> str:
+        """Exporte les poids en .npy pour NumpyNeuralScorer (service sans torch)"""
+        scorer = ItemTowerScorer(self.model)
+        os.makedirs(path, exist_ok=True)
+        
+        arrays = {
+            'user_embedding': scorer.user_embedding.weight,
+            'user_projection': scorer.user_projection.weight,
+            'item_part': scorer.item_part,
+        }
+        head = []
+        for position, layer in enumerate(scorer.head):
+            if isinstance(layer, nn.ReLU):
+                head.append({'type': 'relu'})
+            elif isinstance(layer, nn.Linear):
+                arrays[f'head_{position}_weight'] = layer.weight
+                arrays[f'head_{position}_bias'] = layer.bias
+                head.append({'type': 'linear', 'weight': f'head_{position}_weight',
+                             'bias': f'head_{position}_bias'})
+            else:
+                raise ValueError(f"Couche non supportée par l'export NumPy: {layer}")
+        
+        arrays = {name: tensor.detach().numpy().astype(np.float32) for name, tensor in arrays.items()}
+        arrays.update({
+            'user_ids': self.user_encoder.ids,
+            'movie_ids': self.movie_encoder.ids,
+            'rated_offsets': self.rated_offsets.numpy(),
+            'rated_movies': self.rated_movies.numpy(),
+        })
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
         
-        # Convertir les indices internes en vrais IDs de films
-        top_indices = torch.argsort(predictions, descending=True)[:n_recommendations]
-        recommended_movies = [
-            int(self.reverse_movie_map[idx.item()])  # Conversion explicite en int
-            for idx in top_indices
-        ]
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump({'format_version': NUMPY_FORMAT_VERSION, 'head': head}, f, indent=2)
         
-        print(f" Recommandations neurales pour user {user_id}: {recommended_movies}")
-        return recommended_movies
\ No newline at end of file
+        print(f" Poids NumPy exportés dans {path}")
+        return path
+    
+    def load_inference_model(self, path: str):
+        """Charge un artefact exporté : le service n'utilise plus le modèle d'entraînement"""
+        extra_files = {'user_ids': '', 'movie_ids': '', 'rated_offsets': '', 'rated_movies': ''}
+        self.scorer = torch.jit.load(path, _extra_files=extra_files)
+        arrays = {name: np.load(io.BytesIO(data)) for name, data in extra_files.items()}
+        
+        self.model = None
+        self.user_encoder = IdEncoder.from_arrays(arrays['user_ids'])
+        self.movie_encoder = IdEncoder.from_arrays(arrays['movie_ids'])
+        self.rated_offsets = torch.from_numpy(arrays['rated_offsets'])
+        self.rated_movies = torch.from_numpy(arrays['rated_movies'])
+        print(f" Modèle d'inférence chargé depuis {path}")
+        return self
+    
+    @staticmethod
+    def _array_bytes(array: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return buffer.getvalue()
+    
+    def _accuracy_drift(self, exported, eval_df: Optional[pd.DataFrame] = None,
+                        max_users: int = 256) -> dict:
+        """Compare les scores du modèle exporté à ceux du modèle float32"""
+        reference = ItemTowerScorer(self.model)
+        users = torch.arange(min(max_users, len(self.user_encoder)))
+        with torch.no_grad():
+            drift = exported(users) - reference(users)
+        report = {
+            'score_rmse_drift': float(torch.sqrt(torch.mean(drift ** 2))),
+            'max_abs_drift': float(drift.abs().max()),
+        }
+        
+        if eval_df is not None:
+            user_idx = self.user_encoder.encode(eval_df['user_id'].to_numpy())
+            movie_idx = self.movie_encoder.encode(eval_df['movie_id'].to_numpy())
+            known = (user_idx >= 0) & (movie_idx >= 0)
+            users = torch.from_numpy(user_idx[known])
+            movies = torch.from_numpy(movie_idx[known])
+            ratings = torch.tensor(eval_df['rating'].to_numpy()[known], dtype=torch.float32)
+            with torch.no_grad():
+                self.model.eval()
+                float_rmse = torch.sqrt(torch.mean((self.model(users, movies) - ratings) ** 2))
+                exported_preds = self._predict_pairs(exported, users, movies)
+                exported_rmse = torch.sqrt(torch.mean((exported_preds - ratings) ** 2))
+            report.update({
+                'rmse_float32': float(float_rmse),
+                'rmse_exported': float(exported_rmse),
+                'rmse_increase': float(exported_rmse - float_rmse),
+            })
+        return report
+    
+    def _predict_pairs(self, scorer, users: torch.Tensor, movies: torch.Tensor) -> torch.Tensor:
+        """Prédictions de couples (utilisateur, film) avec un scoreur catalogue complet"""
+        unique_users, inverse = torch.unique(users, return_inverse=True)
+        predictions = torch.empty(len(users))
+        chunk_size = max(1, 2 ** 20 // len(self.movie_encoder))
+        for start in range(0, len(unique_users), chunk_size):
+            with torch.no_grad():
+                block = scorer(unique_users[start:start + chunk_size])
+            in_block = (inverse >= start) & (inverse < start + chunk_size)
+            predictions[in_block] = block[inverse[in_block] - start, movies[in_block]]
+        return predictions
@@ -0,0 +1,112 @@
+import json
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+
+from app.utils.id_encoder import IdEncoder
+from app.utils.ranking import top_k_rows
+
+# Version du format exporté par NeuralRecommendation.export_numpy
+NUMPY_FORMAT_VERSION = 1
+
+
+class NumpyNeuralScorer:
+    """Inférence du modèle neuronal en NumPy pur, sans importer torch.
+
+    Reproduit ItemTowerScorer à partir des poids exportés en .npy : les processus
+    de service démarrent plus vite et consomment beaucoup moins de mémoire.
+    """
+
+    def __init__(self):
+        self.user_embedding = None
+        self.user_projection = None
+        self.item_part = None
+        self.head = []  # couches restantes : ('relu', None, None) ou ('linear', poids, biais)
+        self.user_encoder = IdEncoder()
+        self.movie_encoder = IdEncoder()
+        self.rated_offsets = None
+        self.rated_movies = None
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> "NumpyNeuralScorer":
+        """Charge les poids exportés ; en mmap, les pages sont partagées entre processus"""
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest['format_version'] != NUMPY_FORMAT_VERSION:
+            raise ValueError(f"Version d'artefact non supportée: {manifest['format_version']}")
+
+        def load_array(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        scorer = cls()
+        scorer.user_embedding = load_array('user_embedding')
+        scorer.user_projection = load_array('user_projection')
+        scorer.item_part = load_array('item_part')
+        scorer.head = [
+            (layer['type'],
+             load_array(layer['weight']) if layer['type'] == 'linear' else None,
+             load_array(layer['bias']) if layer['type'] == 'linear' else None)
+            for layer in manifest['head']
+        ]
+        scorer.user_encoder = IdEncoder.from_arrays(load_array('user_ids'))
+        scorer.movie_encoder = IdEncoder.from_arrays(load_array('movie_ids'))
+        scorer.rated_offsets = load_array('rated_offsets')
+        scorer.rated_movies = load_array('rated_movies')
+        print(f" Scoreur NumPy chargé depuis {path}")
+        return scorer
+
+    def score(self, user_idx: np.ndarray, movie_idx: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scores (n_users, n_movies) ; tout le catalogue si movie_idx est None"""
+        user_part = self.user_embedding[user_idx] @ self.user_projection.T
+        item_part = self.item_part if movie_idx is None else self.item_part[movie_idx]
+        hidden = user_part[:, None, :] + item_part[None, :, :]
+        for layer_type, weight, bias in self.head:
+            if layer_type == 'relu':
+                hidden = np.maximum(hidden, 0, out=hidden)
+            else:
+                hidden = hidden @ weight.T + bias
+        return hidden[..., 0]
+
+    def _rated_mask(self, users: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions (ligne, film) des films déjà notés, comme NeuralRecommendation._rated_mask"""
+        starts = np.asarray(self.rated_offsets[users], dtype=np.int64)
+        counts = np.asarray(self.rated_offsets[users + 1], dtype=np.int64) - starts
+        rows = np.repeat(np.arange(len(users)), counts)
+        # Position de chaque note dans rated_movies : début de la ligne + rang dans la ligne
+        first = np.cumsum(counts) - counts
+        positions = np.arange(counts.sum()) - np.repeat(first - starts, counts)
+        return rows, self.rated_movies[positions]
+
+    def recommend(self, user_id: int, n_recommendations: int = 10,
+                  exclude_rated: bool = True) -> List[int]:
+        """Recommandations pour un utilisateur, identiques à NeuralRecommendation.recommend"""
+        movie_ids, _ = self.recommend_batch([user_id], n_recommendations, exclude_rated)
+        return movie_ids[0][movie_ids[0] >= 0].astype(int).tolist()
+
+    def recommend_batch(self, user_ids, n_recommendations: int = 10, exclude_rated: bool = True,
+                        chunk_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Recommandations par lots, même format que NeuralRecommendation.recommend_batch"""
+        user_idx = self.user_encoder.encode(np.asarray(user_ids))
+        known = np.flatnonzero(user_idx >= 0)
+        n_movies = len(self.movie_encoder)
+        n_recommendations = min(n_recommendations, n_movies)
+
+        movie_ids = np.full((len(user_idx), n_recommendations), -1, dtype=np.int64)
+        scores = np.full((len(user_idx), n_recommendations), np.nan, dtype=np.float32)
+        if n_movies == 0:
+            return movie_ids, scores
+        chunk_size = chunk_size or max(1, 2 ** 20 // n_movies)
+
+        for start in range(0, len(known), chunk_size):
+            rows = known[start:start + chunk_size]
+            users = user_idx[rows]
+            predictions = self.score(users)
+            if exclude_rated:
+                predictions[self._rated_mask(users)] = -np.inf
+
+            top_indices, top_scores = top_k_rows(predictions, n_recommendations)
+            valid = np.isfinite(top_scores)
+            movie_ids[rows] = np.where(valid, self.movie_encoder.decode(top_indices), -1)
+            scores[rows] = np.where(valid, top_scores, np.nan)
+
+        return movie_ids, scores
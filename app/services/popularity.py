@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+
+class PopularityIndex:
+    """Classements de popularité précalculés, pour les utilisateurs sans historique.
+
+    Construit à l'entraînement : classement global (nombre de notes, puis note moyenne),
+    top-N par genre à partir des métadonnées films et top-N sur une fenêtre récente
+    quand les notes sont horodatées. Une requête se limite à un découpage de tableau.
+    """
+
+    def __init__(self, top_n: int = 100, recency_days: int = 30):
+        self.top_n = top_n
+        self.recency_days = recency_days
+        self.movie_ids = np.empty(0, dtype=np.int64)  # classement global complet
+        self.scores = np.empty(0, dtype=np.float32)   # nombre de notes
+        self.genre_top = {}     # genre -> (movie_ids, scores), top_n films
+        self.recent_top = None  # (movie_ids, scores) sur la fenêtre récente, None sans timestamp
+
+    def fit(self, ratings_df: pd.DataFrame, movies_df: Optional[pd.DataFrame] = None):
+        """Précalcule les classements à partir des notes et, si fournies, des métadonnées films"""
+        stats = ratings_df.groupby('movie_id')['rating'].agg(['size', 'mean'])
+        stats = stats.sort_values(['size', 'mean'], ascending=False, kind='stable')
+        self.movie_ids = stats.index.to_numpy(dtype=np.int64)
+        self.scores = stats['size'].to_numpy(dtype=np.float32)
+
+        # Top-N par genre : genres séparés par '|' (format MovieLens)
+        self.genre_top = {}
+        if movies_df is not None and 'genres' in movies_df.columns:
+            genres = movies_df[['movie_id', 'genres']].dropna()
+            genres = genres.assign(genre=genres['genres'].str.split('|')).explode('genre')
+            ranked = pd.DataFrame({
+                'movie_id': self.movie_ids,
+                'score': self.scores,
+                'rank': np.arange(len(self.movie_ids)),
+            }).merge(genres[['movie_id', 'genre']], on='movie_id')
+            ranked = ranked.sort_values('rank', kind='stable')
+            for genre, group in ranked.groupby('genre', sort=False):
+                top = group.head(self.top_n)
+                self.genre_top[genre] = (top['movie_id'].to_numpy(dtype=np.int64),
+                                         top['score'].to_numpy(dtype=np.float32))
+
+        # Top-N sur les recency_days derniers jours de données (timestamps Unix en secondes)
+        self.recent_top = None
+        if 'timestamp' in ratings_df.columns:
+            timestamps = ratings_df['timestamp']
+            if pd.api.types.is_datetime64_any_dtype(timestamps):
+                timestamps = timestamps.astype('int64') // 10 ** 9
+            recent = timestamps.to_numpy() >= timestamps.max() - self.recency_days * 86400
+            counts = ratings_df.loc[recent, 'movie_id'].value_counts().head(self.top_n)
+            self.recent_top = (counts.index.to_numpy(dtype=np.int64), counts.to_numpy(dtype=np.float32))
+
+        print(f" Index de popularité: {len(self.movie_ids)} films, {len(self.genre_top)} genres")
+        return self
+
+    def recommend(self, n_recommendations: int = 10, genre: Optional[str] = None,
+                  recent: bool = False, return_scores: bool = False):
+        """Films populaires du genre demandé, de la fenêtre récente, ou à défaut du classement global"""
+        if genre is not None and genre in self.genre_top:
+            movie_ids, scores = self.genre_top[genre]
+        elif recent and self.recent_top is not None:
+            movie_ids, scores = self.recent_top
+        else:
+            movie_ids, scores = self.movie_ids, self.scores
+
+        movie_ids, scores = movie_ids[:n_recommendations], scores[:n_recommendations]
+        if return_scores:
+            return movie_ids, scores
+        return movie_ids.astype(int).tolist()
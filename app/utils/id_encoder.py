@@ -0,0 +1,64 @@
+import numpy as np
+from typing import Iterable, Optional
+
+
+class IdEncoder:
+    """Encode des identifiants externes (user_id, movie_id) en indices contigus.
+
+    Les indices sont stables : un identifiant garde son indice tant que l'encodeur
+    existe, les nouveaux identifiants sont ajoutés à la fin. La recherche se fait
+    par dichotomie sur une copie triée, sans dictionnaire Python.
+    """
+
+    def __init__(self, ids: Optional[Iterable] = None):
+        self.ids = np.empty(0, dtype=np.int64)
+        self._sorted_ids = self.ids
+        self._order = np.empty(0, dtype=np.int64)
+        if ids is not None:
+            self.extend(ids)
+
+    @classmethod
+    def from_arrays(cls, ids: np.ndarray) -> "IdEncoder":
+        """Reconstruit un encodeur à partir du tableau indice -> identifiant"""
+        encoder = cls()
+        encoder.ids = np.asarray(ids)
+        encoder._reindex()
+        return encoder
+
+    def _reindex(self):
+        self._order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, value) -> bool:
+        return self.get(value) is not None
+
+    def get(self, value) -> Optional[int]:
+        """Indice d'un identifiant, ou None s'il est inconnu"""
+        code = self.encode(np.asarray([value]))[0]
+        return None if code < 0 else int(code)
+
+    def encode(self, values) -> np.ndarray:
+        """Encode un tableau d'identifiants, -1 pour les identifiants inconnus"""
+        values = np.asarray(values)
+        if len(self.ids) == 0:
+            return np.full(values.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, values)
+        pos = np.minimum(pos, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == values
+        return np.where(found, self._order[pos], -1)
+
+    def decode(self, codes) -> np.ndarray:
+        """Retrouve les identifiants à partir des indices"""
+        return self.ids[np.asarray(codes, dtype=np.int64)]
+
+    def extend(self, values) -> np.ndarray:
+        """Ajoute les identifiants inconnus et retourne les codes de `values`"""
+        values = np.asarray(values)
+        new_ids = np.unique(values[self.encode(values) < 0])
+        if len(new_ids):
+            self.ids = np.concatenate([self.ids, new_ids.astype(self.ids.dtype)])
+            self._reindex()
+        return self.encode(values)
@@ -1,6 +1,7 @@
 import time
 import requests
 from app.services.hybrid_engine import HybridEngine
+from app.services.neural_embeddings import NeuralRecommendation
 import pandas as pd
 
 def create_performance_data():
@@ -101,12 +102,35 @@ def test_api_performance():
         print(f"⚠️ Erreur API: {e}")
         return False
 
+def test_parallel_training_scaling(worker_counts=(1, 2, 4)):
+    """Benchmark de l'entraînement Hogwild : débit (samples/s) selon le nombre de processus"""
+    print(" Benchmark entraînement neural parallèle...")
+    
+    performance_data = create_performance_data()
+    results = {}
+    
+    for n_workers in worker_counts:
+        neural_rec = NeuralRecommendation()
+        neural_rec.train_parallel(performance_data, n_workers=n_workers, epochs=2, batch_size=128)
+        results[n_workers] = neural_rec.training_stats['samples_per_sec']
+    
+    print(f" {'Processus':>10} | {'samples/s':>10} | {'Accélération':>12}")
+    for n_workers, throughput in results.items():
+        speedup = throughput / results[worker_counts[0]]
+        print(f" {n_workers:>10} | {throughput:>10.0f} | {speedup:>11.2f}x")
+    
+    assert all(throughput > 0 for throughput in results.values())
+    return results
+
 if __name__ == "__main__":
     print(" Lancement des tests de performance RecomSys-Flix...")
     
     # Test du moteur
     engine_success = test_engine_performance()
     
+    # Test de l'entraînement parallèle
+    test_parallel_training_scaling(worker_counts=(1, 2, 4, 8))
+    
     # Test de l'API
     api_success = test_api_performance()
     
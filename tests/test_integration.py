@@ -1,6 +1,8 @@
+import os
 import pytest
 import time
 from app.services.hybrid_engine import HybridEngine
+import numpy as np
 import pandas as pd
 
 def test_hybrid_engine_integration():
@@ -52,4 +54,274 @@ def test_engine_with_unknown_user():
     recommendations = engine.hybrid_recommend(user_id=999, n_recommendations=3)
     
     # Doit retourner une liste (potentiellement vide) sans erreur
-    assert isinstance(recommendations, list)
\ No newline at end of file
+    assert isinstance(recommendations, list)
+
+
+def test_hybrid_fit_training_budget():
+    """Test des paramètres d'entraînement transmis au modèle neuronal"""
+    sample_data = pd.DataFrame({
+        'user_id': [u for u in range(1, 11) for _ in range(4)],
+        'movie_id': [100 + (u * 3 + k) % 12 for u in range(1, 11) for k in range(4)],
+        'rating': [float(1 + (u + k) % 5) for u in range(1, 11) for k in range(4)]
+    })
+    
+    engine = HybridEngine()
+    engine.fit(sample_data, epochs=20, validation_split=0.25, patience=1)
+    
+    history = engine.training_history
+    assert 1 <= len(history['epochs']) <= 20
+    assert history['best_val_rmse'] is not None
+    assert history['stop_reason'] in ('max_epochs', 'early_stopping')
+
+
+def test_hybrid_engine_deadline_fallback():
+    """Un moteur hors délai est ignoré : l'hybride se replie sur l'autre moteur"""
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 3, 3],
+        'movie_id': [101, 102, 101, 103, 102, 104],
+        'rating': [5.0, 4.0, 3.0, 4.5, 4.0, 2.0]
+    })
+    
+    engine = HybridEngine(cf_timeout=0.05)
+    engine.fit(sample_data, epochs=2)
+    
+    def slow_cf(user_id, n_recommendations, return_scores=False):
+        time.sleep(0.5)
+        return np.array([999]), np.array([1.0])
+    engine.cf_engine.recommend_for_user = slow_cf
+    
+    start_time = time.time()
+    recommendations = engine.hybrid_recommend(user_id=1, n_recommendations=3)
+    elapsed = time.time() - start_time
+    
+    assert elapsed < 0.4
+    assert 999 not in recommendations
+    assert recommendations == engine.neural_engine.recommend(1, 3)
+    assert engine.last_request_stats['timed_out'] == ['collaborative']
+    assert engine.timeout_counts == {'collaborative': 1, 'neural': 0}
+
+
+def test_hybrid_score_fusion():
+    """Test de la fusion pondérée et RRF des scores des deux moteurs"""
+    engine = HybridEngine(fusion_weights={'collaborative': 0.7, 'neural': 0.3})
+    engine_results = {
+        'collaborative': (np.array([10, 20, 30]), np.array([3.0, 2.0, 1.0])),
+        'neural': (np.array([30, 40]), np.array([4.5, 2.5])),
+    }
+    
+    movie_ids, scores = engine._fuse(engine_results, 3)
+    # 10 : 0.7 * 1 ; 30 : 0.7 * 0 + 0.3 * 1 ; 20 : 0.7 * 0.5 ; 40 : 0
+    assert movie_ids.tolist() == [10, 20, 30]
+    np.testing.assert_allclose(scores, [0.7, 0.35, 0.3])
+    
+    engine.fusion = 'rrf'
+    movie_ids, scores = engine._fuse(engine_results, 4)
+    # 30 est classé par les deux moteurs : il passe devant le premier film CF
+    assert movie_ids.tolist() == [30, 10, 20, 40]
+    np.testing.assert_allclose(scores[0], 0.7 / 63 + 0.3 / 61)
+    
+    # Aucun moteur disponible : résultat vide
+    movie_ids, scores = engine._fuse({'neural': (np.empty(0, dtype=np.int64), np.empty(0))}, 3)
+    assert len(movie_ids) == 0 and len(scores) == 0
+
+
+def test_hybrid_parallel_fit(tmp_path):
+    """L'entraînement parallèle produit un moteur équivalent à l'entraînement séquentiel"""
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4],
+        'movie_id': [101, 102, 103, 101, 104, 105, 102, 104, 106, 103, 105, 107],
+        'rating': [5.0, 4.0, 3.0, 4.0, 5.0, 3.0, 2.0, 4.0, 5.0, 3.0, 4.0, 2.5]
+    })
+    
+    sequential = HybridEngine()
+    sequential.fit(sample_data, epochs=2)
+    engine = HybridEngine()
+    engine.fit(sample_data, epochs=2, parallel=True, cf_threads=1, neural_threads=1,
+               artifacts_dir=str(tmp_path))
+    
+    assert engine.is_fitted
+    assert set(engine.fit_times) == {'collaborative', 'neural', 'total'}
+    assert engine.training_history['epochs']
+    assert engine.cf_engine.recommend_for_user(1, 3) == sequential.cf_engine.recommend_for_user(1, 3)
+    assert len(engine.neural_engine.recommend(1, 3)) == 3
+    assert isinstance(engine.hybrid_recommend(user_id=2, n_recommendations=3), list)
+    
+    # Un nouvel entraînement au même endroit ne réécrit pas les fichiers du moteur servi
+    served_cf = engine.cf_engine
+    served_data = np.array(served_cf.user_item_matrix.data)
+    first_dir = engine.artifacts_dir
+    engine.fit(sample_data.assign(rating=6.0 - sample_data['rating']), epochs=1, parallel=True,
+               cf_threads=1, neural_threads=1, artifacts_dir=str(tmp_path))
+    assert np.array_equal(served_cf.user_item_matrix.data, served_data)
+    assert engine.artifacts_dir != first_dir
+    assert os.listdir(tmp_path) == [os.path.basename(engine.artifacts_dir)]
+    
+    # Sans artifacts_dir, le répertoire temporaire disparaît dès le retour à un fit séquentiel
+    engine.fit(sample_data, epochs=1, parallel=True, cf_threads=1, neural_threads=1)
+    temp_root = engine._artifacts_root
+    assert not os.path.exists(first_dir) and os.path.isdir(temp_root)
+    engine.fit(sample_data, epochs=1)
+    assert engine.artifacts_dir is None and not os.path.exists(temp_root)
+    assert engine.cf_engine.recommend_for_user(1, 3) == sequential.cf_engine.recommend_for_user(1, 3)
+
+
+def test_hybrid_staged_recommend():
+    """Test du pipeline récupération de candidats puis re-classement neuronal"""
+    sample_data = pd.DataFrame({
+        'user_id': [u for u in range(1, 11) for _ in range(4)],
+        'movie_id': [100 + (u * 3 + k) % 12 for u in range(1, 11) for k in range(4)],
+        'rating': [float(1 + (u + k) % 5) for u in range(1, 11) for k in range(4)]
+    })
+    engine = HybridEngine()
+    engine.fit(sample_data, epochs=2)
+    rated = set(sample_data.loc[sample_data['user_id'] == 1, 'movie_id'])
+    
+    for retriever in ('cf', 'svd', 'popularity'):
+        movie_ids, scores = engine.staged_recommend(1, 3, retriever=retriever, n_candidates=6,
+                                                    return_scores=True, evaluate_recall=True)
+        stats = engine.last_request_stats
+        assert stats['n_candidates'] <= 6
+        assert set(stats['stages']) == {'retrieval', 'ranking'}
+        assert not rated & set(movie_ids.tolist())
+        assert np.all(np.diff(scores) <= 0)
+        # Les scores sont ceux du modèle neuronal sur les candidats
+        np.testing.assert_allclose(scores, engine.neural_engine.score_movies(1, movie_ids), rtol=1e-5)
+    
+    # Avec tout le catalogue en candidats, on retrouve le classement neuronal exhaustif
+    engine.staged_recommend(1, 3, retriever='popularity', n_candidates=100, evaluate_recall=True)
+    assert engine.last_request_stats['candidate_recall'] == 1.0
+    
+    # Utilisateur inconnu : ordre de popularité
+    assert engine.staged_recommend(999, 2, retriever='popularity') == engine.popularity.movie_ids[:2].tolist()
+    with pytest.raises(ValueError):
+        engine.staged_recommend(1, 3, retriever='unknown')
+
+
+def test_hybrid_staged_recommend_tops_up_small_candidate_sets():
+    """Le voisinage CF rend moins de n films : les candidats sont complétés par la popularité"""
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 2, 3, 3, 3],
+        'movie_id': [101, 102, 101, 103, 104, 102, 104, 105],
+        'rating': [4.0, 4.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0]
+    })
+    engine = HybridEngine()
+    engine.fit(sample_data, epochs=2)
+    # Les voisins n'ont donné que des 2.0 : aucun candidat du voisinage
+    assert engine.cf_engine.recommend_for_user(1, 3, mode='user') == []
+    
+    recommendations = engine.staged_recommend(1, 3, n_candidates=10)
+    assert len(recommendations) == 3
+    assert not {101, 102} & set(recommendations)
+    assert engine.last_request_stats['n_candidates'] == 3
+    
+    # Utilisateur ayant tout noté : même repli sur la popularité que hybrid_recommend
+    full = pd.concat([sample_data, pd.DataFrame({
+        'user_id': [4] * 5, 'movie_id': [101, 102, 103, 104, 105], 'rating': [3.0] * 5
+    })], ignore_index=True)
+    engine.fit(full, epochs=1)
+    assert engine.staged_recommend(4, 2) == engine.popularity.movie_ids[:2].tolist()
+    assert engine.last_request_stats == {'fallback': 'popularity'}
+
+
+def test_hybrid_cold_start_fallback():
+    """Un utilisateur inconnu reçoit les films populaires sans calcul de modèle"""
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 3],
+        'movie_id': [101, 102, 101, 103, 101],
+        'rating': [5.0, 4.0, 3.0, 4.5, 4.0],
+        'timestamp': [0, 0, 0, 86400 * 100, 0]
+    })
+    movies = pd.DataFrame({'movie_id': [101, 102, 103], 'genres': ['Drama', 'Comedy', 'Comedy|Drama']})
+    
+    engine = HybridEngine()
+    engine.fit(sample_data, movies, epochs=2)
+    engine.neural_engine.recommend = None  # aucun moteur ne doit être appelé
+    
+    assert engine.hybrid_recommend(user_id=999, n_recommendations=2) == [101, 103]
+    assert engine.hybrid_recommend(user_id=999, n_recommendations=2, genre='Comedy') == [103, 102]
+    assert engine.last_request_stats == {'fallback': 'popularity'}
+    assert engine.hybrid_recommend(user_id=999, n_recommendations=2, recent=True) == [103]
+    
+    # Le pipeline en deux étapes applique le même repli
+    engine.cf_engine.recommend_for_user = None
+    assert engine.staged_recommend(user_id=999, n_recommendations=2) == [101, 103]
+    assert engine.staged_recommend(user_id=999, n_recommendations=2, genre='Comedy') == [103, 102]
+    assert engine.last_request_stats == {'fallback': 'popularity'}
+
+
+def test_hybrid_engine_request_stats_are_per_thread():
+    """Les statistiques de requête d'un thread ne sont pas écrasées par un autre"""
+    import threading
+    
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 3, 3],
+        'movie_id': [101, 102, 101, 103, 102, 104],
+        'rating': [5.0, 4.0, 3.0, 4.5, 4.0, 2.0]
+    })
+    engine = HybridEngine(cf_timeout=0.05, max_workers=2)
+    engine.fit(sample_data, epochs=2)
+    
+    release = threading.Event()
+    def blocked_cf(user_id, n_recommendations, return_scores=False):
+        release.wait(2.0)
+        return np.array([999]), np.array([1.0])
+    engine.cf_engine.recommend_for_user = blocked_cf
+    
+    engine.hybrid_recommend(user_id=1, n_recommendations=3)
+    assert engine.last_request_stats['timed_out'] == ['collaborative']
+    
+    other_stats = {}
+    def other_request():
+        engine.engine_timeouts['collaborative'] = None
+        engine.cf_engine.recommend_for_user = lambda *args, **kwargs: (np.array([103]), np.array([1.0]))
+        engine.hybrid_recommend(user_id=2, n_recommendations=3)
+        other_stats.update(engine.last_request_stats)
+    
+    release.set()
+    thread = threading.Thread(target=other_request)
+    thread.start()
+    thread.join()
+    assert other_stats['timed_out'] == []
+    assert engine.last_request_stats['timed_out'] == ['collaborative']
+
+
+def test_hybrid_engine_cancels_queued_work_on_timeout():
+    """Une tâche hors délai encore en file est annulée au lieu d'occuper le pool"""
+    import threading
+    
+    sample_data = pd.DataFrame({
+        'user_id': [1, 1, 2, 2],
+        'movie_id': [101, 102, 101, 103],
+        'rating': [5.0, 4.0, 3.0, 4.5]
+    })
+    engine = HybridEngine(cf_timeout=0.05, neural_timeout=0.05, max_workers=2)
+    engine.fit(sample_data, epochs=1)
+    
+    calls = []
+    engine.cf_engine.recommend_for_user = lambda *args, **kwargs: calls.append('cf')
+    engine.neural_engine.recommend = lambda *args, **kwargs: calls.append('neural')
+    
+    # Pool saturé : les deux moteurs de la requête restent en file jusqu'à leur délai
+    release = threading.Event()
+    blockers = [engine.executor.submit(release.wait, 2.0) for _ in range(2)]
+    engine.hybrid_recommend(user_id=1, n_recommendations=2)
+    release.set()
+    for blocker in blockers:
+        blocker.result()
+    engine.executor.shutdown(wait=True)
+    
+    assert sorted(engine.last_request_stats['timed_out']) == ['collaborative', 'neural']
+    assert calls == []
+
+
+def test_hybrid_recommend_excludes_rated_movies(sample_ratings_data):
+    """La fusion ne recommande jamais un film déjà noté par l'utilisateur"""
+    engine = HybridEngine()
+    engine.fit(sample_ratings_data)
+    
+    for user_id in sample_ratings_data['user_id'].unique():
+        rated = set(sample_ratings_data.loc[sample_ratings_data['user_id'] == user_id, 'movie_id'])
+        recommendations = engine.hybrid_recommend(user_id=int(user_id), n_recommendations=5)
+        assert recommendations
+        assert not rated & set(recommendations)
+
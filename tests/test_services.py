@@ -1,19 +1,24 @@
+import os
 import pytest
+import numpy as np
 import pandas as pd
 from app.services.collaborative_filtering import CollaborativeFiltering
 from app.services.neural_embeddings import NeuralRecommendation
+from app.services.popularity import PopularityIndex
 
 def test_collaborative_filtering_fit(sample_ratings_data):
     """Test de l'entraînement du filtrage collaboratif"""
     cf = CollaborativeFiltering()
     cf.fit(sample_ratings_data)
     
-    assert cf.user_similarity is not None
+    assert cf.neighbor_indices is not None
     assert cf.user_item_matrix is not None
     assert cf.svd_model is not None
-    # Vérifier que la matrice de similarité a la bonne forme
+    # Vérifier que le graphe de voisins a la bonne forme
     n_users = sample_ratings_data['user_id'].nunique()
-    assert cf.user_similarity.shape == (n_users, n_users)
+    k = min(cf.n_neighbors, n_users - 1)
+    assert cf.neighbor_indices.shape == (n_users, k)
+    assert cf.neighbor_weights.shape == (n_users, k)
 
 def test_collaborative_filtering_recommend(sample_ratings_data):
     """Test des recommandations collaboratives"""
@@ -54,4 +59,587 @@ def test_neural_recommendation_recommend(sample_ratings_data):
     assert isinstance(recommendations, list)
     assert len(recommendations) == 3
     # Vérification CRUCIALE : s'assurer que ce sont des integers
-    assert all(isinstance(movie, int) for movie in recommendations), f"Recommandations: {recommendations}"
\ No newline at end of file
+    assert all(isinstance(movie, int) for movie in recommendations), f"Recommandations: {recommendations}"
+
+def test_collaborative_filtering_sparse_matrix(sample_ratings_data):
+    """Test de la matrice creuse et des correspondances id -> indice"""
+    import scipy.sparse as sp
+
+    cf = CollaborativeFiltering()
+    cf.fit(sample_ratings_data)
+
+    assert sp.isspmatrix_csr(cf.user_item_matrix)
+    assert cf.user_item_matrix.dtype == 'float32'
+    assert cf.user_item_matrix.nnz == len(sample_ratings_data)
+
+    # Chaque note doit se retrouver à la position donnée par les encodeurs
+    for row in sample_ratings_data.itertuples():
+        user_idx = cf.user_encoder.get(row.user_id)
+        movie_idx = cf.movie_encoder.get(row.movie_id)
+        assert cf.user_item_matrix[user_idx, movie_idx] == row.rating
+    assert cf.user_encoder.get(999) is None
+
+
+def test_collaborative_filtering_recommend_scores(sample_ratings_data):
+    """Test des scores retournés par le filtrage collaboratif"""
+    cf = CollaborativeFiltering()
+    cf.fit(sample_ratings_data)
+
+    movie_ids, scores = cf.recommend_for_user(user_id=1, n_recommendations=3, return_scores=True)
+
+    assert len(movie_ids) == len(scores) <= 3
+    assert list(scores) == sorted(scores, reverse=True)
+    assert all(score > 0 for score in scores)
+    assert movie_ids.tolist() == cf.recommend_for_user(user_id=1, n_recommendations=3)
+
+
+def test_collaborative_filtering_neighbor_graph(sample_ratings_large):
+    """Test du graphe k-NN calculé par blocs"""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    cf = CollaborativeFiltering(n_neighbors=3, block_size=4)
+    cf.fit(sample_ratings_large)
+
+    n_users = sample_ratings_large['user_id'].nunique()
+    assert cf.neighbor_indices.shape == (n_users, 3)
+
+    # Les poids correspondent aux meilleures similarités cosinus (hors soi-même)
+    full = cosine_similarity(cf.user_item_matrix)
+    np.fill_diagonal(full, -np.inf)
+    for user_idx in range(n_users):
+        expected = np.sort(full[user_idx])[::-1][:3]
+        assert np.allclose(cf.neighbor_weights[user_idx], expected, atol=1e-5)
+        assert user_idx not in cf.neighbor_indices[user_idx]
+
+
+def test_ivf_index_full_probe_is_exact():
+    """Test de l'index IVF : sonder toutes les listes donne le résultat exact"""
+    from app.services.ann_index import IVFIndex
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 8)).astype(np.float32)
+    query = rng.normal(size=8).astype(np.float32)
+
+    index = IVFIndex(n_lists=10, n_probe=2).fit(vectors)
+    indices, scores = index.search(query, k=5, n_probe=10, exclude=np.array([0, 1]))
+
+    exact = vectors @ query
+    exact[[0, 1]] = -np.inf
+    assert indices.tolist() == np.argsort(-exact)[:5].tolist()
+    assert np.allclose(scores, exact[indices])
+
+    # Avec moins de listes sondées, on ne parcourt qu'une partie du catalogue
+    approx_indices, _ = index.search(query, k=5)
+    assert len(approx_indices) <= 5
+
+
+def test_collaborative_filtering_svd_ann_mode(sample_ratings_large):
+    """Test du mode de recommandation par facteurs SVD et index approximatif"""
+    cf = CollaborativeFiltering(mode='svd_ann', ann_n_lists=3, ann_n_probe=3)
+    ratings = sample_ratings_large[
+        (sample_ratings_large['user_id'] + sample_ratings_large['movie_id']) % 3 != 0
+    ]
+    cf.fit(ratings)
+
+    movie_ids, scores = cf.recommend_for_user(user_id=1, n_recommendations=3, return_scores=True)
+
+    rated = ratings[ratings['user_id'] == 1]['movie_id'].tolist()
+    assert 0 < len(movie_ids) <= 3
+    assert not set(movie_ids.tolist()) & set(rated)
+    assert list(scores) == sorted(scores, reverse=True)
+
+    with pytest.raises(ValueError):
+        cf.recommend_for_user(user_id=1, mode='unknown')
+
+
+def test_collaborative_filtering_item_mode(sample_ratings_data):
+    """Test du mode item-item avec listes de voisins précalculées"""
+    cf = CollaborativeFiltering(mode='item', n_item_neighbors=3)
+    cf.fit(sample_ratings_data)
+
+    n_movies = sample_ratings_data['movie_id'].nunique()
+    assert cf.item_neighbor_indices.shape == (n_movies, 3)
+
+    movie_ids, scores = cf.recommend_for_user(user_id=1, n_recommendations=3, return_scores=True)
+
+    user_1_rated = sample_ratings_data[sample_ratings_data['user_id'] == 1]['movie_id'].tolist()
+    assert 0 < len(movie_ids) <= 3
+    assert not set(movie_ids.tolist()) & set(user_1_rated)
+    assert list(scores) == sorted(scores, reverse=True)
+
+    # Le mode item n'est pas disponible sans listes précalculées
+    with pytest.raises(ValueError):
+        CollaborativeFiltering().fit(sample_ratings_data).recommend_for_user(1, mode='item')
+
+
+def test_collaborative_filtering_partial_fit(sample_ratings_large):
+    """Test de la mise à jour incrémentale sans réentraînement complet"""
+    initial = sample_ratings_large[sample_ratings_large['movie_id'] <= 8]
+    cf = CollaborativeFiltering(mode='item', n_neighbors=3, n_item_neighbors=3)
+    cf.fit(initial)
+    components_before = cf.svd_model.components_.copy()
+
+    new_ratings = pd.DataFrame({
+        'user_id': [1, 21, 21, 22],
+        'movie_id': [9, 1, 9, 2],
+        'rating': [5.0, 4.0, 5.0, 3.0]
+    })
+    cf.partial_fit(new_ratings)
+
+    n_users, n_movies = cf.user_item_matrix.shape
+    assert (n_users, n_movies) == (22, 9)
+    assert cf.user_item_matrix[cf.user_encoder.get(21), cf.movie_encoder.get(9)] == 5.0
+    assert cf.svd_matrix.shape[0] == n_users
+    assert cf.item_factors.shape[0] == n_movies
+    assert cf.neighbor_indices.shape == (n_users, 3)
+    assert cf.item_neighbor_indices.shape == (n_movies, 3)
+    # La base SVD des films existants n'est pas recalculée
+    assert np.allclose(cf.svd_model.components_[:, :8], components_before)
+
+    # Les nouveaux utilisateurs sont servis immédiatement
+    assert isinstance(cf.recommend_for_user(user_id=22, n_recommendations=3), list)
+    assert cf.recommend_for_user(user_id=21, mode='svd_ann')
+
+
+def test_collaborative_filtering_partial_fit_new_movie_by_new_user(sample_ratings_large):
+    """Un nouveau film noté seulement par de nouveaux utilisateurs reçoit un facteur non nul"""
+    initial = sample_ratings_large[sample_ratings_large['movie_id'] <= 8]
+    cf = CollaborativeFiltering(n_components=4)
+    cf.fit(initial)
+
+    # Nouvel utilisateur avec historique sur les films connus : projection par ses facteurs
+    cf.partial_fit(pd.DataFrame({'user_id': [30, 30, 30], 'movie_id': [1, 2, 100],
+                                 'rating': [5.0, 4.0, 5.0]}))
+    assert np.any(cf.item_factors[cf.movie_encoder.get(100)])
+    assert np.any(cf.svd_matrix[cf.user_encoder.get(30)])
+
+    # Une seule note d'un nouvel utilisateur sur un nouveau film : facteur du film moyen
+    cf.partial_fit(pd.DataFrame({'user_id': [31], 'movie_id': [200], 'rating': [4.0]}))
+    assert np.any(cf.item_factors[-1])
+    assert 200 in cf.recommend_for_user(user_id=1, n_recommendations=cf.item_factors.shape[0], mode='svd')
+
+
+@pytest.mark.parametrize('mode', ['user', 'item', 'svd', 'svd_ann'])
+def test_collaborative_filtering_batch_matches_single(sample_ratings_data, mode):
+    """Test des recommandations par lots : mêmes résultats qu'utilisateur par utilisateur"""
+    cf = CollaborativeFiltering(mode=mode, n_item_neighbors=3)
+    cf.fit(sample_ratings_data)
+
+    user_ids = [1, 2, 999, 3, 4, 5]
+    movie_ids, scores = cf.recommend_for_users(user_ids, n_recommendations=3, chunk_size=2)
+
+    assert movie_ids.shape == scores.shape == (len(user_ids), 3)
+    # Utilisateur inconnu : ligne vide
+    assert (movie_ids[2] == -1).all() and np.isnan(scores[2]).all()
+
+    for row, user_id in enumerate(user_ids):
+        if user_id == 999:
+            continue
+        expected_ids, expected_scores = cf.recommend_for_user(user_id, 3, return_scores=True)
+        valid = movie_ids[row] >= 0
+        assert movie_ids[row][valid].tolist() == expected_ids.tolist()
+        assert np.allclose(scores[row][valid], expected_scores, atol=1e-5)
+
+
+def test_collaborative_filtering_batch_process_pool(sample_ratings_large):
+    """Test des recommandations par lots réparties sur plusieurs processus"""
+    ratings = sample_ratings_large[
+        (sample_ratings_large['user_id'] + sample_ratings_large['movie_id']) % 3 != 0
+    ]
+    cf = CollaborativeFiltering(n_neighbors=10)
+    cf.fit(ratings)
+
+    user_ids = ratings['user_id'].unique()
+    sequential = cf.recommend_for_users(user_ids, n_recommendations=5, chunk_size=4)
+    parallel = cf.recommend_for_users(user_ids, n_recommendations=5, chunk_size=4, n_jobs=2)
+
+    assert (sequential[0] >= 0).any()
+    assert np.array_equal(sequential[0], parallel[0])
+    assert np.allclose(sequential[1], parallel[1], equal_nan=True)
+
+    # Mode item : la matrice des films similaires est construite à l'entraînement, pas par bloc
+    cf = CollaborativeFiltering(mode='item', n_item_neighbors=5)
+    cf.fit(ratings)
+    similarity = cf.item_similarity
+    sequential = cf.recommend_for_users(user_ids, n_recommendations=5, chunk_size=4)
+    parallel = cf.recommend_for_users(user_ids, n_recommendations=5, chunk_size=4, n_jobs=2)
+    assert cf.item_similarity is similarity
+    assert np.array_equal(sequential[0], parallel[0])
+
+
+def test_collaborative_filtering_batch_concurrent_pools(sample_ratings_large):
+    """Deux appels parallèles sur des modèles différents gardent chacun leur modèle"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    ratings = sample_ratings_large[
+        (sample_ratings_large['user_id'] + sample_ratings_large['movie_id']) % 3 != 0
+    ]
+    models = [CollaborativeFiltering(n_neighbors=10, mode=mode).fit(ratings) for mode in ('user', 'svd')]
+    user_ids = ratings['user_id'].unique()
+    expected = [model.recommend_for_users(user_ids, 5, chunk_size=4)[0] for model in models]
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(
+            lambda model: model.recommend_for_users(user_ids, 5, chunk_size=4, n_jobs=2)[0], models
+        ))
+    for result, reference in zip(results, expected):
+        assert np.array_equal(result, reference)
+
+    # Modèle non entraîné : tableaux vides, sans erreur
+    movie_ids, scores = CollaborativeFiltering().recommend_for_users([1, 2], 3)
+    assert movie_ids.shape == scores.shape == (2, 0)
+
+
+def test_collaborative_filtering_save_load(sample_ratings_data, tmp_path):
+    """Test de la sauvegarde et du chargement en mmap du modèle collaboratif"""
+    cf = CollaborativeFiltering(mode='item', n_item_neighbors=3)
+    cf.fit(sample_ratings_data)
+    cf.save(str(tmp_path / 'cf'))
+
+    loaded = CollaborativeFiltering.load(str(tmp_path / 'cf'))
+
+    assert isinstance(loaded.neighbor_indices, np.memmap)
+    assert loaded.mode == 'item'
+    for user_id in [1, 2, 3]:
+        for mode in ['user', 'item', 'svd', 'svd_ann']:
+            assert (loaded.recommend_for_user(user_id, 3, mode=mode)
+                    == cf.recommend_for_user(user_id, 3, mode=mode))
+
+    # Un modèle chargé accepte encore des mises à jour incrémentales
+    loaded.partial_fit(pd.DataFrame({'user_id': [6], 'movie_id': [101], 'rating': [4.0]}))
+    assert 6 in loaded.user_encoder
+
+
+def test_collaborative_filtering_save_does_not_touch_mapped_files(sample_ratings_data, tmp_path):
+    """Une nouvelle sauvegarde au même endroit ne modifie pas un modèle déjà chargé en mmap"""
+    path = str(tmp_path / 'cf')
+    CollaborativeFiltering().fit(sample_ratings_data).save(path)
+    live = CollaborativeFiltering.load(path)
+    live_data = np.array(live.user_item_matrix.data)
+
+    retrained = sample_ratings_data.assign(rating=6.0 - sample_ratings_data['rating'])
+    for _ in range(3):
+        CollaborativeFiltering().fit(retrained).save(path, keep_versions=2)
+
+    assert np.array_equal(live.user_item_matrix.data, live_data)
+    reloaded = CollaborativeFiltering.load(path)
+    assert not np.array_equal(reloaded.user_item_matrix.data, live_data)
+    assert len([name for name in os.listdir(path) if name.startswith('v')]) == 2
+
+
+def test_collaborative_filtering_svd_options(sample_ratings_large):
+    """Test de la SVD randomisée float32, de ses options et du budget de temps"""
+    cf = CollaborativeFiltering(n_components=4, svd_oversamples=5, svd_power_iter=2)
+    cf.fit(sample_ratings_large)
+
+    assert cf.svd_model.n_components == 4
+    assert cf.svd_matrix.dtype == np.float32
+    assert cf.item_factors.dtype == np.float32
+    assert {'matrix', 'neighbors', 'svd', 'total'} <= set(cf.fit_times)
+
+    # Un budget minuscule réduit le nombre de composants au minimum
+    budgeted = CollaborativeFiltering(n_components=8, svd_time_budget=1e-9)
+    budgeted.fit(sample_ratings_large)
+    assert budgeted.svd_model.n_components == 2
+
+
+def test_collaborative_filtering_svd_mode(sample_ratings_data):
+    """Test du moteur SVD : produit scalaire exhaustif sur les facteurs latents"""
+    cf = CollaborativeFiltering(mode='svd')
+    cf.fit(sample_ratings_data)
+
+    movie_ids, scores = cf.recommend_for_user(user_id=1, n_recommendations=3, return_scores=True)
+
+    user_idx = cf.user_encoder.get(1)
+    expected = cf.svd_matrix[user_idx] @ cf.svd_model.components_
+    rated = sample_ratings_data[sample_ratings_data['user_id'] == 1]['movie_id']
+    expected[cf.movie_encoder.encode(rated.to_numpy())] = -np.inf
+    best = np.argsort(-expected)[:3]
+
+    assert movie_ids.tolist() == cf.movie_encoder.decode(best).tolist()
+    assert np.allclose(scores, expected[best], atol=1e-5)
+
+    # La recherche approchée sondant toutes les listes donne le même résultat
+    ann_ids = cf.recommend_for_user(user_id=1, n_recommendations=3, mode='svd_ann')
+    cf.ann_index.n_probe = len(cf.ann_index.centroids)
+    assert cf.recommend_for_user(user_id=1, n_recommendations=3, mode='svd_ann') == movie_ids.tolist()
+    assert len(ann_ids) <= 3
+
+
+def test_neural_recommendation_minibatch_train(sample_ratings_large):
+    """Test de l'entraînement par mini-batchs et du débit mesuré"""
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_large, epochs=2, batch_size=16)
+
+    stats = neural_rec.training_stats
+    assert stats['n_samples'] == len(sample_ratings_large)
+    assert stats['batch_size'] == 16
+    assert stats['samples_per_sec'] > 0
+
+    # Un batch de taille 1 ne doit pas casser la forme des prédictions
+    neural_rec.train(sample_ratings_large.head(12), epochs=1, batch_size=1, shuffle=False)
+    assert len(neural_rec.recommend(user_id=2, n_recommendations=2)) == 2
+
+
+def test_neural_validation_and_early_stopping(sample_ratings_large):
+    """Test du split de validation, de l'arrêt anticipé et du budget de temps"""
+    neural_rec = NeuralRecommendation(learning_rate=0.05)
+    history = neural_rec.train(sample_ratings_large, epochs=50, batch_size=16,
+                               validation_split=0.2, patience=2)
+
+    assert neural_rec.training_stats['n_validation'] == int(len(sample_ratings_large) * 0.2)
+    assert all(record['val_rmse'] is not None for record in history['epochs'])
+    assert history['best_val_rmse'] == min(record['val_rmse'] for record in history['epochs'])
+    if history['stop_reason'] == 'early_stopping':
+        assert len(history['epochs']) == history['best_epoch'] + 3
+    assert neural_rec.training_history is history
+
+    # Un split invalide est refusé avant de toucher au modèle entraîné
+    with pytest.raises(ValueError):
+        neural_rec.train(sample_ratings_large, validation_split=1.0)
+    assert len(neural_rec.recommend(user_id=1, n_recommendations=2, exclude_rated=False)) == 2
+
+    # Un budget nul arrête l'entraînement avant la première epoch complète
+    history = neural_rec.train(sample_ratings_large, epochs=5, batch_size=1, max_time=0.0)
+    assert history['stop_reason'] == 'time_budget'
+    assert len(history['epochs']) <= 1
+    assert neural_rec.scorer is not None
+
+
+def test_neural_recommendation_id_encoding(sample_ratings_data):
+    """Test de l'encodage vectorisé des identifiants du modèle neuronal"""
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=1)
+
+    movie_ids = sample_ratings_data['movie_id'].to_numpy()
+    codes = neural_rec.movie_encoder.encode(movie_ids)
+    assert (codes >= 0).all()
+    assert (neural_rec.movie_encoder.decode(codes) == movie_ids).all()
+    assert neural_rec.movie_encoder.encode([999]).tolist() == [-1]
+
+    # Les vues dict restent cohérentes avec l'ordre trié des identifiants
+    assert neural_rec.user_id_map == {uid: idx for idx, uid in
+                                      enumerate(sorted(sample_ratings_data['user_id'].unique()))}
+
+
+def test_neural_item_tower_matches_model(sample_ratings_data):
+    """Test du scoreur à partie film précalculée : mêmes scores que le modèle complet"""
+    import torch
+
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=2)
+    n_movies = len(neural_rec.movie_encoder)
+
+    users = torch.tensor([0, 2], dtype=torch.long)
+    movies = torch.arange(n_movies)
+    neural_rec.model.eval()
+    with torch.no_grad():
+        expected = torch.stack([
+            neural_rec.model(user.repeat(n_movies), movies) for user in users
+        ])
+        scores = neural_rec.scorer(users)
+        subset = neural_rec.scorer(users, movies[:3])
+
+    assert scores.shape == (2, n_movies)
+    assert torch.allclose(scores, expected, atol=1e-5)
+    assert torch.allclose(subset, expected[:, :3], atol=1e-5)
+
+    # Un nouvel entraînement reconstruit le cache
+    scorer = neural_rec.scorer
+    neural_rec.train(sample_ratings_data, epochs=1)
+    assert neural_rec.scorer is not scorer
+
+
+def test_neural_recommend_batch(sample_ratings_data):
+    """Test des recommandations neuronales par lots avec exclusion des films notés"""
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=2)
+
+    user_ids = [1, 2, 999, 5]
+    movie_ids, scores = neural_rec.recommend_batch(user_ids, n_recommendations=4, chunk_size=2)
+
+    assert movie_ids.shape == scores.shape == (len(user_ids), 4)
+    assert (movie_ids[2] == -1).all() and np.isnan(scores[2]).all()
+
+    for row, user_id in enumerate(user_ids):
+        if user_id == 999:
+            continue
+        rated = set(sample_ratings_data[sample_ratings_data['user_id'] == user_id]['movie_id'])
+        recommended = movie_ids[row][movie_ids[row] >= 0]
+        assert not set(recommended.tolist()) & rated
+        valid_scores = scores[row][~np.isnan(scores[row])]
+        assert list(valid_scores) == sorted(valid_scores, reverse=True)
+        assert neural_rec.recommend(user_id, 4) == recommended.tolist()
+
+    # Sans exclusion, les films notés peuvent être recommandés
+    all_ids, _ = neural_rec.recommend_batch([1], n_recommendations=8, exclude_rated=False)
+    assert set(all_ids[0].tolist()) == set(sample_ratings_data['movie_id'])
+
+    # Modèle non entraîné : tableaux vides, sans erreur
+    movie_ids, scores = NeuralRecommendation().recommend_batch([1, 2], n_recommendations=4)
+    assert movie_ids.shape == scores.shape == (2, 0)
+
+
+def test_neural_export_inference_model(sample_ratings_data, tmp_path):
+    """Test de l'export TorchScript int8 et du rapport d'écart de précision"""
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=2)
+    expected = neural_rec.recommend(user_id=1, n_recommendations=3)
+
+    path = str(tmp_path / 'neural.pt')
+    report = neural_rec.export_inference_model(path, quantize=True, eval_df=sample_ratings_data)
+    assert report['quantized']
+    assert report['score_rmse_drift'] < 0.1
+    assert abs(report['rmse_increase']) < 0.1
+
+    served = NeuralRecommendation().load_inference_model(path)
+    assert served.model is None
+    recommendations = served.recommend(user_id=1, n_recommendations=3)
+    user_1_rated = sample_ratings_data[sample_ratings_data['user_id'] == 1]['movie_id'].tolist()
+    assert len(recommendations) == 3
+    assert not set(recommendations) & set(user_1_rated)
+    assert served.recommend(user_id=999) == []
+
+    # Sans quantification, l'artefact figé reproduit exactement le modèle float32
+    float_path = str(tmp_path / 'neural_float.pt')
+    assert neural_rec.export_inference_model(float_path, quantize=False)['max_abs_drift'] < 1e-5
+    assert NeuralRecommendation().load_inference_model(float_path).recommend(1, 3) == expected
+
+
+def test_numpy_scorer_matches_torch(sample_ratings_data, tmp_path):
+    """Test du scoreur NumPy : mêmes sorties que le modèle torch, sans importer torch"""
+    import pathlib
+    import subprocess
+    import sys
+    import torch
+    from app.services.numpy_scorer import NumpyNeuralScorer
+
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=2)
+    path = neural_rec.export_numpy(str(tmp_path / 'neural_npy'))
+
+    scorer = NumpyNeuralScorer.load(path)
+    users = np.arange(len(neural_rec.user_encoder))
+    with torch.no_grad():
+        expected = neural_rec.scorer(torch.from_numpy(users)).numpy()
+    assert np.allclose(scorer.score(users), expected, atol=1e-5)
+
+    for user_id in [1, 2, 999]:
+        assert scorer.recommend(user_id, 3) == neural_rec.recommend(user_id, 3)
+    batch_ids, _ = scorer.recommend_batch([1, 2, 3, 999], n_recommendations=4, chunk_size=3)
+    assert np.array_equal(batch_ids, neural_rec.recommend_batch([1, 2, 3, 999], n_recommendations=4)[0])
+    movie_ids, _ = NumpyNeuralScorer().recommend_batch([1], n_recommendations=3)
+    assert movie_ids.shape == (1, 0)
+
+    # Le module de service ne doit pas importer torch
+    code = ("import sys; from app.services.numpy_scorer import NumpyNeuralScorer; "
+            "assert 'torch' not in sys.modules")
+    project_root = str(pathlib.Path(__file__).resolve().parents[1])
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=project_root)
+
+
+def test_neural_checkpoint_and_warm_start(sample_ratings_data, tmp_path):
+    """Test du checkpoint et de la reprise d'entraînement avec nouveaux identifiants"""
+    import torch
+
+    neural_rec = NeuralRecommendation()
+    neural_rec.train(sample_ratings_data, epochs=2)
+    path = str(tmp_path / 'checkpoint.pt')
+    neural_rec.save_checkpoint(path)
+
+    restored = NeuralRecommendation().load_checkpoint(path)
+    assert restored.recommend(user_id=1, n_recommendations=3) == neural_rec.recommend(1, 3)
+    user_weights = restored.model.user_embedding.weight
+    old_weights = user_weights.detach().clone()
+
+    # Nouvelles notes : un nouvel utilisateur et un nouveau film
+    new_ratings = pd.DataFrame({
+        'user_id': [6, 6, 1],
+        'movie_id': [101, 109, 109],
+        'rating': [4.0, 5.0, 3.0]
+    })
+    restored.train(new_ratings, epochs=1, warm_start=True)
+
+    n_users = sample_ratings_data['user_id'].nunique() + 1
+    n_movies = sample_ratings_data['movie_id'].nunique() + 1
+    assert restored.model.user_embedding.weight is user_weights  # agrandie en place
+    assert restored.model.user_embedding.weight.shape[0] == n_users
+    assert restored.model.movie_embedding.weight.shape[0] == n_movies
+    assert restored.optimizers[0].state[user_weights]['exp_avg'].shape[0] == n_users
+    # L'entraînement repart des poids existants au lieu d'une initialisation aléatoire
+    assert torch.allclose(user_weights[:n_users - 1], old_weights, atol=0.05)
+
+    # Les films déjà notés, anciens et nouveaux, restent exclus
+    recommendations = restored.recommend(user_id=1, n_recommendations=10)
+    assert not set(recommendations) & {101, 102, 103, 109}
+    assert 6 in restored.user_encoder
+
+
+def test_neural_sparse_embeddings(sample_ratings_data, tmp_path):
+    """Test des embeddings creux avec SparseAdam pour les tables et Adam pour fc_layers"""
+    import torch
+
+    neural_rec = NeuralRecommendation(sparse_embeddings=True)
+    neural_rec.train(sample_ratings_data, epochs=1, batch_size=4)
+
+    assert neural_rec.model.user_embedding.sparse
+    sparse_adam, dense_adam = neural_rec.optimizers
+    assert isinstance(sparse_adam, torch.optim.SparseAdam)
+    assert isinstance(dense_adam, torch.optim.Adam)
+    assert len(neural_rec.recommend(user_id=1, n_recommendations=3)) == 3
+
+    # Seules les lignes vues dans un batch sont mises à jour
+    user_weights = neural_rec.model.user_embedding.weight
+    before = user_weights.detach().clone()
+    neural_rec.train(sample_ratings_data[sample_ratings_data['user_id'] == 1],
+                     epochs=1, warm_start=True)
+    changed = (user_weights.detach() != before).any(dim=1)
+    assert changed.tolist() == [idx == neural_rec.user_encoder.get(1) for idx in range(len(before))]
+
+    # Le checkpoint conserve le mode creux et les deux optimiseurs
+    path = str(tmp_path / 'sparse.pt')
+    neural_rec.save_checkpoint(path)
+    restored = NeuralRecommendation().load_checkpoint(path)
+    assert restored.sparse_embeddings and len(restored.optimizers) == 2
+
+
+def test_neural_train_parallel(sample_ratings_large):
+    """Test de l'entraînement Hogwild multi-processus"""
+    neural_rec = NeuralRecommendation()
+    neural_rec.train_parallel(sample_ratings_large, n_workers=2, epochs=2, batch_size=32)
+
+    stats = neural_rec.training_stats
+    assert stats['n_workers'] == 2
+    assert len(stats['worker_samples_per_sec']) == 2
+    assert stats['samples_per_sec'] > 0
+    assert len(neural_rec.recommend(user_id=1, n_recommendations=3, exclude_rated=False)) == 3
+
+
+def test_popularity_index():
+    """Test des classements global, par genre et récent de l'index de popularité"""
+    ratings = pd.DataFrame({
+        'user_id': [1, 2, 3, 1, 2, 1, 4],
+        'movie_id': [101, 101, 101, 102, 102, 103, 104],
+        'rating': [4.0, 5.0, 3.0, 2.0, 3.0, 5.0, 4.0],
+        'timestamp': [0, 0, 0, 86400 * 100, 86400 * 100, 0, 86400 * 99],
+    })
+    movies = pd.DataFrame({
+        'movie_id': [101, 102, 103, 104],
+        'genres': ['Drama|Comedy', 'Comedy', 'Drama', 'Horror'],
+    })
+    index = PopularityIndex(top_n=2, recency_days=7).fit(ratings, movies)
+
+    # Nombre de notes puis note moyenne : 103 (5.0) passe devant 104 (4.0)
+    assert index.recommend(4) == [101, 102, 103, 104]
+    assert index.recommend(5, genre='Drama') == [101, 103]
+    assert index.recommend(5, genre='Comedy') == [101, 102]
+    assert index.recommend(5, recent=True) == [102, 104]
+    # Genre inconnu : classement global
+    movie_ids, scores = index.recommend(2, genre='Western', return_scores=True)
+    assert movie_ids.tolist() == [101, 102] and scores.tolist() == [3.0, 2.0]
+
+    # Sans métadonnées ni timestamp, seul le classement global existe
+    index = PopularityIndex().fit(ratings.drop(columns='timestamp'))
+    assert index.genre_top == {} and index.recent_top is None
+    assert index.recommend(2, recent=True) == [101, 102]
+